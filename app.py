@@ -1,10 +1,20 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import subprocess
 import os
 import json
 import csv
+import io
+import itertools
+import sys
+import threading
+import time
+import zipfile
 from datetime import datetime
+from pathlib import PurePosixPath
+
+import cv2
+import numpy as np
 
 app = Flask(__name__, static_folder='.', template_folder='.')
 CORS(app)
@@ -13,15 +23,165 @@ CORS(app)
 PYTHON_CMD = 'py -3.10'
 PYTHON_FOLDER = './python/'
 DATASET = './dataset'
-ENCODINGS = os.path.join(PYTHON_FOLDER, 'encodings.pkl')
+ENCODINGS = os.path.join(PYTHON_FOLDER, 'encodings.bin')
 STUDENTS_CSV = './students.csv'
 ATTENDANCE_CSV = './attendance.csv'
-RESULT_JSON = './result.json'
+DB_PATH = './fras.db'
+PROFILES = './profiles'
+
+# Allow ?profile=1 to sample a request's stacks into PROFILES (off by default)
+PROFILING = os.environ.get('FRAS_PROFILING') == '1'
+
+# Recognition worker processes for /api/recognize-frames (0 = in the server process)
+RECOGNITION_WORKERS = int(os.environ.get('FRAS_RECOGNITION_WORKERS', '0'))
+RECOGNITION_MODE = os.environ.get('FRAS_RECOGNITION_MODE', 'replicate')
+
+# Processes for /api/register-bulk encoding (0 = one per core, at most 4)
+ENCODE_WORKERS = int(os.environ.get('FRAS_ENCODE_WORKERS', '0'))
+
+# Seconds within which a student is not marked present again
+DEDUP_WINDOW = float(os.environ.get('FRAS_DEDUP_WINDOW', '300'))
+
+# Recognition scripts live in PYTHON_FOLDER; import them in-process
+sys.path.insert(0, os.path.abspath(PYTHON_FOLDER))
+from attendance_writer import open_writer
+from engine import RecognitionEngine
+from jobs import JobQueue
+import metrics
+from recognition_pool import RecognitionPool
+from stats import StatsCache
+from storage import open_storage
+
+# Resident recognition engine (models + encodings loaded once at startup)
+engine = RecognitionEngine(ENCODINGS, dataset=DATASET, threshold=0.35,
+                           encode_workers=ENCODE_WORKERS or None)
+engine_lock = threading.Lock()
+
+def get_engine():
+    with engine_lock:
+        if engine.startup_time is None:
+            engine.start()
+    return engine
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+    """Recognition worker pool, started on first use (None when disabled)"""
+    global pool
+    if RECOGNITION_WORKERS <= 0:
+        return None
+    with pool_lock:
+        if pool is None:
+            pool = RecognitionPool(get_engine(), RECOGNITION_WORKERS, RECOGNITION_MODE).start()
+    return pool
 
-# Ensure necessary files exist
-for file_path in [STUDENTS_CSV, ATTENDANCE_CSV]:
-    if not os.path.exists(file_path):
-        open(file_path, 'w').close()
+def run_encode(job):
+    """Job: incremental re-encode of the dataset"""
+    progress = lambda done, total: job.progress(done / total, f'Encoded {done}/{total} images')
+    summary = get_engine().rebuild(progress=progress)
+    if summary is None:
+        raise RuntimeError('No faces were encoded')
+    return summary
+
+def run_register(job):
+    """Job: capture samples with register.py, then queue a re-encode"""
+    params = job.params
+    register_path = os.path.join(PYTHON_FOLDER, 'register.py')
+    register_cmd = f'{PYTHON_CMD} "{register_path}" {params["id"]} "{params["name"]}" {params["samples"]}'
+    print(f"Command: {register_cmd}")
+    
+    job.progress(0, 'Capturing images')
+    try:
+        register_result = subprocess.run(
+            register_cmd,
+            shell=True,
+            capture_output=True,
+            text=True,
+            timeout=120,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+    except subprocess.TimeoutExpired:
+        raise RuntimeError('Image capture timed out')
+    
+    print(f"\n{'='*60}")
+    print(f"REGISTER.PY OUTPUT:")
+    print(f"{'='*60}")
+    print(f"Return code: {register_result.returncode}")
+    print(f"\nSTDOUT:\n{register_result.stdout}")
+    if register_result.stderr:
+        print(f"\nSTDERR:\n{register_result.stderr}")
+    print(f"{'='*60}\n")
+    
+    if register_result.returncode != 0:
+        raise RuntimeError(f'Failed to capture images: {register_result.stderr or register_result.stdout}')
+    
+    # Encoding runs as its own (coalesced) job
+    encode_job = job_queue.submit('encode', coalesce=True)
+    return {'id': params['id'], 'name': params['name'], 'encode_job': encode_job['id']}
+
+def get_jobs():
+    return job_queue.start()
+
+# Worker processes (recognition pool, bulk encoding) are spawned and
+# re-import this file as __mp_main__; only the server opens the database,
+# starts the attendance writer and owns the job queue
+if __name__ != '__mp_main__':
+    # Students/attendance database (imports the legacy CSV files on first run)
+    storage = open_storage(DB_PATH, STUDENTS_CSV, ATTENDANCE_CSV)
+    stats_cache = StatsCache(storage, ENCODINGS)
+    
+    # Attendance rows are batched and de-duplicated by one writer thread
+    attendance_writer = open_writer(storage, dedup_window=DEDUP_WINDOW)
+    
+    # Background jobs (registration capture, re-encoding) persisted in the database
+    job_queue = JobQueue(storage, workers=2)
+    job_queue.register('encode', run_encode)
+    # A capture opens the camera; never replay one after a crash with nobody in front of it
+    job_queue.register('register', run_register, replay=False)
+    
+    # Scrape-time gauges for /metrics
+    metrics.REGISTRY.gauge('gallery_encodings',
+                           lambda: len(engine.matcher.gallery) if engine.matcher else None,
+                           'Encodings in the loaded gallery')
+    metrics.REGISTRY.gauge('gallery_generation', lambda: engine.generation,
+                           'Generation of the loaded gallery')
+    metrics.REGISTRY.gauge('jobs_queued', lambda: job_queue.count('queued'),
+                           'Background jobs waiting to run')
+    metrics.REGISTRY.gauge('recognition_workers_alive', lambda: pool.status()['alive'] if pool else None,
+                           'Live recognition worker processes')
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.sampler = None
+    if PROFILING and request.args.get('profile') == '1':
+        g.sampler = metrics.Sampler().start()
+
+@app.after_request
+def record_timing(response):
+    endpoint = request.endpoint or 'unknown'
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    metrics.REGISTRY.observe('http_request_seconds', elapsed, endpoint=endpoint, method=request.method)
+    metrics.count('http_requests', endpoint=endpoint, method=request.method, status=response.status_code)
+    sampler = g.get('sampler')
+    if sampler is not None:
+        sampler.stop()
+        os.makedirs(PROFILES, exist_ok=True)
+        path = os.path.join(PROFILES, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{endpoint}.folded")
+        with open(path, 'w') as f:
+            f.write(sampler.collapsed())
+        response.headers['X-Profile'] = path
+        print(f"[PROFILE] {request.path}: {sampler.samples} samples -> {path}")
+    return response
+
+def job_response(job, message):
+    return jsonify({
+        'success': True,
+        'message': message,
+        'job_id': job['id'],
+        'status_url': f"/api/jobs/{job['id']}"
+    }), 202
 
 @app.route('/')
 def index():
@@ -57,74 +217,12 @@ def add_student():
             }), 500
         
         print(f"✓ register.py found at: {register_path}")
-        
-        # Build command
-        register_cmd = f'{PYTHON_CMD} "{register_path}" {student_id} "{name}" {samples}'
-        print(f"Command: {register_cmd}")
         print(f"{'='*60}\n")
         
-        # Run register.py
-        print("Executing register.py...")
-        register_result = subprocess.run(
-            register_cmd,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=120,
-            cwd=os.path.dirname(os.path.abspath(__file__))
-        )
-        
-        print(f"\n{'='*60}")
-        print(f"REGISTER.PY OUTPUT:")
-        print(f"{'='*60}")
-        print(f"Return code: {register_result.returncode}")
-        print(f"\nSTDOUT:\n{register_result.stdout}")
-        if register_result.stderr:
-            print(f"\nSTDERR:\n{register_result.stderr}")
-        print(f"{'='*60}\n")
-        
-        if register_result.returncode != 0:
-            return jsonify({
-                'success': False,
-                'error': 'Failed to capture images',
-                'details': register_result.stderr or register_result.stdout
-            }), 500
-        
-        # Auto encode database
-        print("Starting database encoding...")
-        encode_path = os.path.join(PYTHON_FOLDER, 'encode_db.py')
-        encode_cmd = f'{PYTHON_CMD} "{encode_path}" "{DATASET}" "{ENCODINGS}"'
-        print(f"Encode command: {encode_cmd}")
-        
-        encode_result = subprocess.run(
-            encode_cmd,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=120,
-            cwd=os.path.dirname(os.path.abspath(__file__))
-        )
-        
-        print(f"\nENCODE_DB.PY OUTPUT:")
-        print(f"Return code: {encode_result.returncode}")
-        print(f"STDOUT: {encode_result.stdout}")
-        if encode_result.stderr:
-            print(f"STDERR: {encode_result.stderr}")
-        
-        print(f"\n{'='*60}")
-        print(f"✓ STUDENT ADDED SUCCESSFULLY")
-        print(f"{'='*60}\n")
-        
-        return jsonify({
-            'success': True,
-            'message': f'Student {name} added successfully',
-            'id': student_id,
-            'name': name
-        })
+        # Capture + encode run in the background; poll the job for progress
+        job = get_jobs().submit('register', {'id': student_id, 'name': name, 'samples': samples})
+        return job_response(job, f'Registration of {name} queued')
         
-    except subprocess.TimeoutExpired:
-        print("ERROR: Operation timeout")
-        return jsonify({'success': False, 'error': 'Operation timeout'}), 408
     except Exception as e:
         print(f"ERROR: {str(e)}")
         import traceback
@@ -139,60 +237,23 @@ def recognize():
         print(f"RECOGNITION REQUEST")
         print(f"{'='*60}\n")
         
-        # Auto encode database first
-        encode_path = os.path.join(PYTHON_FOLDER, 'encode_db.py')
-        encode_cmd = f'{PYTHON_CMD} "{encode_path}" "{DATASET}" "{ENCODINGS}"'
-        subprocess.run(encode_cmd, shell=True, timeout=60)
-        
-        # Run recognition
-        recognize_path = os.path.join(PYTHON_FOLDER, 'recognize.py')
-        recognize_cmd = f'{PYTHON_CMD} "{recognize_path}" "{ENCODINGS}" 0.35'
-        print(f"Command: {recognize_cmd}")
-        
-        recognize_result = subprocess.run(
-            recognize_cmd,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        
-        print(f"\nRECOGNIZE.PY OUTPUT:")
-        print(f"Return code: {recognize_result.returncode}")
-        print(f"STDOUT:\n{recognize_result.stdout}")
-        if recognize_result.stderr:
-            print(f"STDERR:\n{recognize_result.stderr}")
+        # Pick up new images in the background; recognition uses the current gallery
+        get_jobs().submit('encode', coalesce=True)
+        eng = get_engine()
         
-        if recognize_result.returncode != 0:
-            return jsonify({
-                'success': False,
-                'error': 'Recognition failed',
-                'details': recognize_result.stderr or recognize_result.stdout
-            }), 500
+        # Run recognition in the resident engine
+        result_data = eng.recognize()
         
-        # Read result.json
-        if os.path.exists(RESULT_JSON):
-            with open(RESULT_JSON, 'r') as f:
-                result_data = json.load(f)
-            
-            # Get student name from students.csv
-            student_name = 'Unknown'
-            if os.path.exists(STUDENTS_CSV):
-                with open(STUDENTS_CSV, 'r') as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if row and row[0] == result_data.get('id', ''):
-                            student_name = row[1] if len(row) > 1 else 'Unknown'
-                            break
-            
-            print(f"✓ Recognition successful: {student_name}\n")
+        if result_data is not None:
+            print(f"✓ Recognition successful: {result_data['name']}\n")
             
             return jsonify({
                 'success': True,
-                'id': result_data.get('id', ''),
-                'name': student_name,
-                'time': result_data.get('time', ''),
-                'distance': result_data.get('distance', '')
+                'id': result_data['id'],
+                'name': result_data['name'],
+                'time': result_data['time'],
+                'distance': f"{result_data['distance']:.4f}",
+                'duplicate': result_data['duplicate']
             })
         else:
             return jsonify({
@@ -200,68 +261,283 @@ def recognize():
                 'error': 'No face detected or recognized'
             }), 404
             
-    except subprocess.TimeoutExpired:
-        return jsonify({'success': False, 'error': 'Operation timeout'}), 408
+    except TimeoutError as e:
+        return jsonify({'success': False, 'error': str(e)}), 408
     except Exception as e:
         print(f"ERROR: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def request_blobs():
+    """Encoded frames from multipart files or a raw JPEG body"""
+    blobs = [f.read() for key in request.files for f in request.files.getlist(key)]
+    if not blobs and request.content_type and request.content_type.startswith('image/'):
+        blobs = [request.get_data()]
+    return blobs
+
+def decode_frames(blobs):
+    """Frames decoded in memory (RGB)"""
+    frames = []
+    for blob in blobs:
+        image = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f'Could not decode image {len(frames) + 1}')
+        frames.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return frames
+
+@app.route('/api/recognize-frames', methods=['POST'])
+def recognize_frames():
+    """Recognize faces in frames uploaded by the browser (no server camera)"""
+    try:
+        blobs = request_blobs()
+        if not blobs:
+            return jsonify({'success': False, 'error': 'No image provided'}), 400
+        threshold = request.values.get('threshold', type=float)
+        mark = request.values.get('mark', '0').lower() in ('1', 'true', 'yes')
+        
+        eng = get_engine()
+        workers = get_pool()
+        if workers is not None:
+            # Decoding and recognition both happen in the worker processes
+            matches = workers.match_blobs(blobs, threshold)
+        else:
+            eng.refresh()
+            matches = [eng.match_image(rgb, threshold) for rgb in decode_frames(blobs)]
+        
+        results, best = [], {}
+        for frame_matches in matches:
+            faces = []
+            for (top, right, bottom, left), (sid, dist) in frame_matches:
+                faces.append({
+                    'id': sid,
+                    'name': storage.student_name(sid) if sid is not None else None,
+                    'distance': round(dist, 4),
+                    'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left}
+                })
+                if sid is not None and dist < best.get(sid, float('inf')):
+                    best[sid] = dist
+            results.append({'faces': faces})
+        
+        # Optionally mark everyone recognized, once per request at their best distance
+        marked = eng.mark_attendance([{'id': sid, 'distance': d} for sid, d in best.items()]) if mark else []
+        
+        return jsonify({'success': True, 'frames': results, 'marked': marked})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/session/start', methods=['POST'])
+def start_session():
+    """Start a classroom session that recognises every face in view"""
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            threshold = float(data['threshold']) if data.get('threshold') is not None else None
+            duration = float(data['duration']) if data.get('duration') is not None else None
+            min_hits = int(data.get('min_hits', 3))
+            window = float(data.get('window', 3.0))
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': f'Invalid session parameter: {e}'}), 400
+        # Pick up new images in the background; the session uses the current gallery
+        get_jobs().submit('encode', coalesce=True)
+        eng = get_engine()
+        session = eng.start_session(threshold=threshold, duration=duration,
+                                    min_hits=min_hits, window=window)
+        return jsonify({'success': True, 'started': session.started})
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/session', methods=['GET'])
+def session_status():
+    """Students confirmed so far in the running session"""
+    status = get_engine().session_status()
+    if status is None:
+        return jsonify({'success': False, 'error': 'No session running'}), 404
+    return jsonify({'success': True, **status})
+
+@app.route('/api/session/stop', methods=['POST'])
+def stop_session():
+    """Stop the session and mark attendance for everyone confirmed"""
+    try:
+        session, rows = get_engine().stop_session()
+        if session is None:
+            return jsonify({'success': False, 'error': 'No session running'}), 404
+        marked = sum(1 for r in rows if not r['duplicate'])
+        print(f"✓ Session finished: {marked} students marked, {len(rows) - marked} already marked")
+        return jsonify({
+            'success': True,
+            'frames': session.frames,
+            'error': session.error,
+            'marked': rows
+        })
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/students', methods=['GET'])
 def get_students():
     """Get list of all students"""
     try:
-        students = []
-        if os.path.exists(STUDENTS_CSV):
-            with open(STUDENTS_CSV, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row and len(row) >= 2:
-                        students.append({
-                            'id': row[0],
-                            'name': row[1]
-                        })
+        students = storage.list_students()
         return jsonify(students)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def attendance_filters(args):
+    """Attendance filters from query parameters (ValueError on bad numbers)"""
+    distance = lambda key: float(args[key]) if args.get(key) else None
+    return {
+        'student_id': args.get('student_id') or None,
+        'start': args.get('from') or None,
+        'end': args.get('to') or None,
+        'min_distance': distance('min_distance'),
+        'max_distance': distance('max_distance')
+    }
+
+@app.route('/api/attendance/latest', methods=['GET'])
+def latest_attendance():
+    """Most recent attendance mark accepted by this server (committed or about to be)"""
+    row = attendance_writer.latest()
+    if row is None:
+        return jsonify({'success': False, 'error': 'No attendance marked yet'}), 404
+    return jsonify({'success': True, **row})
+
 @app.route('/api/attendance', methods=['GET'])
 def get_attendance():
-    """Get attendance records"""
+    """Get one page of attendance records, newest first"""
     try:
-        records = []
-        if os.path.exists(ATTENDANCE_CSV):
-            with open(ATTENDANCE_CSV, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row and len(row) >= 4:
-                        records.append({
-                            'id': row[0],
-                            'name': row[1],
-                            'time': row[2],
-                            'distance': row[3]
-                        })
-        return jsonify(records)
+        filters = attendance_filters(request.args)
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        rows, next_cursor = storage.query_attendance(
+            cursor=request.args.get('cursor'), limit=limit, **filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    records = [{
+        'id': r['id'],
+        'name': r['name'],
+        'time': r['time'],
+        'distance': '' if r['distance'] is None else f"{r['distance']:.4f}"
+    } for r in rows]
+    return jsonify({'records': records, 'next_cursor': next_cursor})
 
 @app.route('/api/export', methods=['GET'])
 def export_data():
-    """Export attendance data"""
+    """Export attendance data as CSV or NDJSON (optionally for a date range)"""
     try:
-        if os.path.exists(ATTENDANCE_CSV):
-            return send_file(
-                ATTENDANCE_CSV,
-                mimetype='text/csv',
-                as_attachment=True,
-                download_name=f'attendance_{datetime.now().strftime("%Y%m%d")}.csv'
-            )
-        else:
+        fmt = request.args.get('format', 'csv')
+        if fmt not in ('csv', 'ndjson'):
+            return jsonify({'error': f'Unknown format: {fmt}'}), 400
+        filters = attendance_filters(request.args)
+        # The first chunk tells whether anything matched; no separate COUNT(*) scan
+        chunks = storage.export_attendance(fmt, **filters)
+        first = next(chunks, None)
+        if first is None:
             return jsonify({'error': 'No attendance data found'}), 404
+        
+        # Stream the rest straight from the database cursor
+        filename = f'attendance_{datetime.now().strftime("%Y%m%d")}.{fmt}'
+        return Response(
+            stream_with_context(itertools.chain([first], chunks)),
+            mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+
+def valid_student_id(sid):
+    return bool(sid) and sid not in ('.', '..') and not any(c in sid for c in '/\\:')
+
+def bulk_sources(default_id, names):
+    """(student id, read(), box) per uploaded image, without reading the images yet.
+
+    Plain files belong to the directory in their filename ("<id>/x.jpg") or
+    to the student_id form field. Zip archives hold <id>/*.jpg, optional
+    <id>/*.json face-box sidecars and an optional students.csv (id,name).
+    """
+    sources = []
+    uploads = [f for key in request.files for f in request.files.getlist(key)]
+    archives = [zipfile.ZipFile(f.stream) for f in uploads if f.filename.lower().endswith('.zip')]
+    if not uploads and request.content_type in ('application/zip', 'application/x-zip-compressed'):
+        archives.append(zipfile.ZipFile(io.BytesIO(request.get_data())))
+    
+    for f in uploads:
+        if f.filename.lower().endswith('.zip'):
+            continue
+        path = PurePosixPath(f.filename.replace('\\', '/'))
+        sid = path.parent.name or default_id
+        if not valid_student_id(sid):
+            raise ValueError(f'No valid student id for {f.filename}')
+        sources.append((sid, f.read, None))
+    
+    for archive in archives:
+        members = set(archive.namelist())
+        for name in sorted(members):
+            path = PurePosixPath(name)
+            if path.name == 'students.csv':
+                text = archive.read(name).decode('utf-8')
+                names.update({row[0].strip(): row[1].strip() for row in csv.reader(io.StringIO(text))
+                              if len(row) >= 2 and row[0].strip()})
+                continue
+            if path.suffix.lower() not in IMAGE_EXTS:
+                continue
+            sid = path.parent.name or default_id
+            if not valid_student_id(sid):
+                raise ValueError(f'No valid student id for {name}')
+            box = None
+            sidecar = str(path.with_suffix('.json'))
+            if sidecar in members:
+                try:
+                    top, right, bottom, left = (int(v) for v in json.loads(archive.read(sidecar))['box'])
+                    box = (top, right, bottom, left) if bottom > top and right > left else None
+                except (ValueError, KeyError, TypeError):
+                    box = None
+            sources.append((sid, lambda a=archive, n=name: a.read(n), box))
+    return sources
+
+@app.route('/api/register-bulk', methods=['POST'])
+def register_bulk():
+    """Register many images for one or many students in a single upload"""
+    try:
+        default_id = request.form.get('student_id', '').strip()
+        names = json.loads(request.form.get('names') or '{}')
+        if default_id and request.form.get('name'):
+            names[default_id] = request.form['name'].strip()
+        
+        sources = bulk_sources(default_id, names)
+        if not sources:
+            return jsonify({'success': False, 'error': 'No images provided'}), 400
+        
+        # Images are read one by one while earlier ones are being encoded
+        summary = get_engine().register_bulk((sid, read(), box) for sid, read, box in sources)
+        
+        for sid in summary['students']:
+            if sid in names:
+                storage.upsert_student(sid, names[sid])
+            else:
+                storage.add_student(sid, sid)
+        
+        print(f"Bulk registration: {summary['encoded']} new encodings for "
+              f"{len(summary['students'])} students, {len(summary['rejected'])} rejected")
+        return jsonify({'success': True, **summary})
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in register_bulk: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/save-image', methods=['POST'])
 def save_image():
     """Save captured image from frontend"""
@@ -281,6 +557,12 @@ def save_image():
         image_path = os.path.join(student_folder, f"{student_id}_{index}.jpg")
         image.save(image_path)
         
+        # Optional face box "top,right,bottom,left" lets encoding skip detection
+        box = request.form.get('box')
+        if box:
+            from encode_db import write_sidecar
+            write_sidecar(image_path, [int(float(v)) for v in box.split(',')])
+        
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -293,74 +575,56 @@ def finalize_registration():
         student_id = data.get('id')
         name = data.get('name')
         
-        # Add to students.csv
-        student_exists = False
-        students = []
-        
-        if os.path.exists(STUDENTS_CSV):
-            with open(STUDENTS_CSV, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row and row[0] == student_id:
-                        student_exists = True
-                        students.append([student_id, name])
-                    else:
-                        students.append(row)
-        
-        if not student_exists:
-            students.append([student_id, name])
-        
-        with open(STUDENTS_CSV, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerows(students)
-        
-        # Encode database
-        encode_path = os.path.join(PYTHON_FOLDER, 'encode_db.py')
-        encode_cmd = f'{PYTHON_CMD} "{encode_path}" "{DATASET}" "{ENCODINGS}"'
-        encode_result = subprocess.run(
-            encode_cmd,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        
-        print(f"Encoding completed with return code: {encode_result.returncode}")
+        # Add or rename the student
+        storage.upsert_student(student_id, name)
         
-        return jsonify({
-            'success': True,
-            'message': f'Student {name} registered successfully'
-        })
+        # Re-encode in the background; concurrent requests share one queued run
+        job = get_jobs().submit('encode', coalesce=True)
+        return job_response(job, f'Student {name} registered, encoding queued')
         
     except Exception as e:
         print(f"Error in finalize_registration: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/encode', methods=['POST'])
+def encode():
+    """Queue an incremental re-encode of the dataset"""
+    try:
+        job = get_jobs().submit('encode', coalesce=True)
+        return job_response(job, 'Encoding queued')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Recent background jobs, newest first"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        return jsonify(job_queue.list(request.args.get('status'), limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status and progress of one background job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Latency histograms, counters and gauges in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get system statistics"""
     try:
-        # Count students
-        student_count = 0
-        if os.path.exists(STUDENTS_CSV):
-            with open(STUDENTS_CSV, 'r') as f:
-                student_count = sum(1 for line in f if line.strip())
-        
-        # Count attendance records
-        attendance_count = 0
-        if os.path.exists(ATTENDANCE_CSV):
-            with open(ATTENDANCE_CSV, 'r') as f:
-                attendance_count = sum(1 for line in f if line.strip())
-        
-        # Check if database is encoded
-        database_ready = os.path.exists(ENCODINGS)
-        
-        return jsonify({
-            'students': student_count,
-            'attendance_records': attendance_count,
-            'database_ready': database_ready,
-            'dataset_path': DATASET
-        })
+        stats = stats_cache.snapshot()
+        stats['database_ready'] = os.path.exists(ENCODINGS)
+        stats['dataset_path'] = DATASET
+        return jsonify(stats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -373,11 +637,16 @@ if __name__ == '__main__':
     print("🚀 FRAS Web Server Starting...")
     print("=" * 50)
     print(f"📁 Dataset: {DATASET}")
-    print(f"📄 Students CSV: {STUDENTS_CSV}")
-    print(f"📊 Attendance CSV: {ATTENDANCE_CSV}")
+    print(f"🗄️ Database: {DB_PATH}")
     print(f"🐍 Python folder: {PYTHON_FOLDER}")
     print("=" * 50)
     print("🌐 Open your browser and go to: http://localhost:5000")
     print("=" * 50)
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Load models and resume queued jobs in the serving process (not the debug reloader parent)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_engine()
+        get_jobs()
+    
+    # Threaded so several kiosks can upload frames at once
+    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""Batched attendance writes with a per-student dedup window.
+
+Recognition used to commit one transaction per marked student. It also
+marked a student again every time they walked past the camera, and passed
+the last result to main.cpp through result.json. AttendanceWriter keeps
+accepted rows in memory and commits them on a background thread. A batch
+is committed when it reaches `batch_size` rows, when its oldest row is
+`flush_interval` seconds old, or when flush() or close() is called. The
+writer's own connection runs with synchronous=FULL, so every batch is
+fsynced once rather than every row.
+
+A student marked within `dedup_window` seconds of their previous mark is
+reported back as a duplicate and not written. The index of last marks is
+kept in memory and seeded from the database, so a restart (or the next
+recognize.py run) keeps honouring the window.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from storage import open_storage
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class AttendanceWriter:
+    """Buffer of accepted attendance rows, committed by one writer thread."""
+
+    def __init__(self, storage, dedup_window=300.0, flush_interval=1.0, batch_size=64):
+        self.storage = storage
+        self.dedup_window = dedup_window
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._pending = []
+        self._oldest = None
+        self._submitted = 0
+        self._flushed = 0
+        self._flush_now = False
+        self._closing = False
+        self._last_marked = None
+        self._latest = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def _seed(self):
+        # Last mark per student still inside the window, from earlier runs
+        since = (datetime.now() - timedelta(seconds=self.dedup_window)).strftime(TIME_FORMAT)
+        rows = self.storage.connect().execute(
+            "SELECT student_id, MAX(time) FROM attendance WHERE time >= ? GROUP BY student_id",
+            (since,))
+        return {sid: datetime.strptime(t, TIME_FORMAT).timestamp() for sid, t in rows}
+
+    def submit(self, entries):
+        """Queue {"id", "distance"[, "time"]} entries; one result row per entry.
+
+        Rows carry "duplicate": True (and the earlier mark's time) for
+        students already marked within the dedup window; those are not
+        written.
+        """
+        results = []
+        with self._cond:
+            if self._last_marked is None:
+                self._last_marked = self._seed()
+            for entry in entries:
+                when = entry.get("time") or time.time()
+                sid = entry["id"]
+                last = self._last_marked.get(sid)
+                row = {
+                    "id": sid,
+                    "name": self.storage.student_name(sid),
+                    "time": datetime.fromtimestamp(when).strftime(TIME_FORMAT),
+                    "distance": float(entry["distance"]),
+                    "duplicate": last is not None and when - last < self.dedup_window,
+                }
+                if row["duplicate"]:
+                    row["time"] = datetime.fromtimestamp(last).strftime(TIME_FORMAT)
+                    metrics.count("attendance_duplicates")
+                else:
+                    self._last_marked[sid] = when
+                    self._pending.append(row)
+                    self._submitted += 1
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                    self._latest = row
+                results.append(row)
+            self._cond.notify_all()
+        return results
+
+    def latest(self):
+        """Most recently accepted row (written or still buffered), or None."""
+        with self._cond:
+            return dict(self._latest) if self._latest else None
+
+    def flush(self, timeout=10.0):
+        """Commit everything submitted so far; False if that took over `timeout`."""
+        with self._cond:
+            target = self._submitted
+            if self._flushed < target:
+                self._flush_now = True
+                self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._flushed >= target, timeout)
+
+    def close(self, timeout=10.0):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _due(self):
+        if not self._pending:
+            return False
+        return (self._flush_now or self._closing or len(self._pending) >= self.batch_size
+                or time.monotonic() - self._oldest >= self.flush_interval)
+
+    def _run(self):
+        # This thread's connection only: fsync each batch commit
+        self.storage.connect().execute("PRAGMA synchronous=FULL")
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._closing:
+                        return
+                    wait = None
+                    if self._oldest is not None:
+                        wait = max(0.0, self._oldest + self.flush_interval - time.monotonic())
+                    self._cond.wait(wait)
+                batch, self._pending, self._oldest = self._pending, [], None
+                self._flush_now = False
+            try:
+                self.storage.add_attendance([{k: r[k] for k in ("id", "name", "time", "distance")}
+                                             for r in batch])
+            except Exception as e:
+                print(f"[ERROR] Could not write {len(batch)} attendance row(s): {e}")
+                with self._cond:
+                    # Keep them for the next attempt, ahead of newer rows
+                    self._pending = batch + self._pending
+                    self._oldest = time.monotonic()
+                    if self._closing:
+                        return
+                    self._cond.wait(self.flush_interval)
+                continue
+            metrics.count("attendance_batches")
+            with self._cond:
+                self._flushed += len(batch)
+                self._cond.notify_all()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def open_writer(storage=None, **config):
+    """Shared AttendanceWriter for this process; `config` applies on first call."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = AttendanceWriter(storage or open_storage(), **config).start()
+            # Commit what is still buffered when the process exits
+            atexit.register(_default.close)
+        return _default
@@ -0,0 +1,84 @@
+"""Detection recall vs. time per detection scale, over the dataset images.
+
+Usage:
+    bench_detect.py [dataset] [--scales 1 0.75 0.5 0.35 0.25] [--upsample 0]
+                    [--face-fraction 0.2] [--limit 200]
+
+The reference faces of each image are found at full resolution with one
+upsample (the most thorough HOG setting). Every setting - the fixed scales
+plus the adaptive policy - is timed on the same images, and a reference
+face counts as recalled when a detected box overlaps it (IoU >= 0.5).
+"""
+import argparse
+import time
+from pathlib import Path
+
+import models
+from detection import DetectionPolicy
+from encode_db import DATASET
+from tracking import iou
+
+
+def load_images(dataset, limit):
+    paths = sorted(Path(dataset).glob("*/*.jpg"))[:limit]
+    return [(p, models.load_image_file(str(p))) for p in paths]
+
+
+def run(policy, images):
+    t0 = time.perf_counter()
+    found = [policy.detect(image) for _, image in images]
+    return found, (time.perf_counter() - t0) / max(len(images), 1)
+
+
+def recall(found, reference):
+    hits = total = 0
+    for boxes, ref in zip(found, reference):
+        total += len(ref)
+        hits += sum(1 for r in ref if any(iou(r, b) >= 0.5 for b in boxes))
+    return hits / total * 100 if total else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dataset", nargs="?", default=str(DATASET))
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.35, 0.25])
+    parser.add_argument("--upsample", type=int, default=0)
+    parser.add_argument("--face-fraction", type=float, default=0.2,
+                        help="smallest face for the adaptive policy, as a fraction of the shorter side")
+    parser.add_argument("--limit", type=int, default=200, help="images to use")
+    args = parser.parse_args()
+
+    images = load_images(args.dataset, args.limit)
+    if not images:
+        print(f"[ERROR] No images found in {args.dataset}")
+        return
+
+    reference, ref_s = run(DetectionPolicy(upsample=1, scale=1.0), images)
+    faces = sum(len(r) for r in reference)
+    pixels = sum(image.shape[0] * image.shape[1] for _, image in images) / len(images)
+
+    print("\n============================================================")
+    print("DETECTION SCALE BENCHMARK")
+    print("============================================================")
+    print(f"Images:    {len(images)} from {args.dataset} (mean {pixels / 1e6:.2f} MP)")
+    print(f"Reference: {faces} faces at full resolution, upsample 1 "
+          f"({ref_s * 1000:.1f} ms/image)")
+    print("============================================================\n")
+    print(f"{'setting':<22} {'ms/image':>9} {'speed-up':>9} {'recall':>8} {'boxes':>6}")
+
+    settings = [(f"scale {s:g}", DetectionPolicy(upsample=args.upsample, scale=s))
+                for s in args.scales]
+    adaptive = DetectionPolicy(face_fraction=args.face_fraction, upsample=args.upsample)
+    settings.append((f"adaptive {args.face_fraction:g}", adaptive))
+    for name, policy in settings:
+        found, s = run(policy, images)
+        print(f"{name:<22} {s * 1000:>9.1f} {ref_s / s:>8.1f}x "
+              f"{recall(found, reference):>7.1f}% {sum(len(f) for f in found):>6}")
+
+    scales = sorted({adaptive.scale_for(image.shape) for _, image in images})
+    print(f"\nAdaptive scales used: {', '.join(f'{s:g}' for s in scales)} "
+          f"(upsample {args.upsample})\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compare the resident RecognitionEngine against one subprocess per request.
+
+Usage:
+    bench_engine.py <encodings_path> <probe.jpg> [probe.jpg ...] [--requests N]
+
+The subprocess path mimics what app.py used to do for every /api/recognize:
+start a fresh interpreter, load the face_recognition models, read the
+encodings and match one frame. The engine path pays that startup once and
+then only matches.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def child(encodings_path, probe):
+    # Runs inside the spawned interpreter, reports where the time went
+    t0 = time.perf_counter()
+    import models
+    import recognize
+    models.warm_up()
+    t1 = time.perf_counter()
+    matcher = recognize.load_matcher(encodings_path)
+    t2 = time.perf_counter()
+    rgb = models.load_image_file(probe)
+    recognize.match_frame(rgb, matcher, 0.35)
+    t3 = time.perf_counter()
+    print(json.dumps({"import": t1 - t0, "load": t2 - t1, "match": t3 - t2}))
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    print(f"{label:<28} mean {statistics.mean(samples)*1000:9.1f} ms   "
+          f"p50 {statistics.median(samples)*1000:9.1f} ms   p95 {p95*1000:9.1f} ms")
+
+
+def bench_subprocess(encodings_path, probes, requests):
+    walls, imports = [], []
+    for i in range(requests):
+        probe = probes[i % len(probes)]
+        t0 = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", encodings_path, probe],
+            capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent)
+        walls.append(time.perf_counter() - t0)
+        timings = json.loads(out.stdout.strip().splitlines()[-1])
+        imports.append(timings["import"] + timings["load"])
+    return walls, imports
+
+
+def bench_engine(encodings_path, probes, requests):
+    import models
+    from engine import RecognitionEngine
+
+    t0 = time.perf_counter()
+    eng = RecognitionEngine(encodings_path).start()
+    startup = time.perf_counter() - t0
+
+    images = [models.load_image_file(p) for p in probes]
+    latencies = []
+    for i in range(requests):
+        t0 = time.perf_counter()
+        eng.refresh()
+        eng.match_image(images[i % len(images)])
+        latencies.append(time.perf_counter() - t0)
+    return startup, latencies
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("encodings")
+    parser.add_argument("probes", nargs="+")
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    print("\n============================================================")
+    print("ENGINE vs SUBPROCESS BENCHMARK")
+    print("============================================================")
+    print(f"Encodings: {args.encodings}")
+    print(f"Probes:    {len(args.probes)} image(s), {args.requests} requests each path")
+    print("============================================================\n")
+
+    walls, starts = bench_subprocess(args.encodings, args.probes, args.requests)
+    startup, latencies = bench_engine(args.encodings, args.probes, args.requests)
+
+    summarize("subprocess startup", starts)
+    summarize("subprocess per request", walls)
+    print(f"{'engine startup (once)':<28} {startup*1000:14.1f} ms")
+    summarize("engine per request", latencies)
+    print(f"\nSpeed-up per request: {statistics.mean(walls) / statistics.mean(latencies):.1f}x\n")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+    else:
+        main(sys.argv[1:])
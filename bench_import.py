@@ -0,0 +1,114 @@
+"""Cold-start cost of the recognition scripts: imports, models, first inference.
+
+Usage:
+    bench_import.py [probe.jpg] [--runs 5]
+
+Every measurement runs in a fresh interpreter, like the subprocesses
+app.py and main.cpp start:
+  import     importing each module; shows whether it pulled in
+             face_recognition (dlib and its models) on the way
+  --help     running the script until argparse exits, the cheapest
+             invocation of each CLI
+  models     models.warm_up() (face_recognition import plus one encoding)
+  first      detection and encoding of the probe image: cold pays the
+             import and dlib's lazy first-call setup, warm runs after
+             warm_up()
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+MODULES = ["register", "recognize", "encode_db", "quality", "engine", "detection", "session"]
+SCRIPTS = ["register.py", "recognize.py", "encode_db.py", "quality.py"]
+
+IMPORT = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+print(json.dumps({{"s": time.perf_counter() - t0, "dlib": "face_recognition" in sys.modules}}))
+"""
+
+FIRST = """
+import json, time
+t0 = time.perf_counter()
+import models
+warm = models.warm_up() if {warm} else 0.0
+rgb = models.load_image_file({probe!r})
+t1 = time.perf_counter()
+boxes = models.face_locations(rgb)
+models.face_encodings(rgb, boxes)
+print(json.dumps({{"s": time.perf_counter() - t1, "warm": warm, "total": time.perf_counter() - t0}}))
+"""
+
+
+def child(code):
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=HERE)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr else "failed")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def wall(args):
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable] + args, capture_output=True, cwd=HERE)
+    return time.perf_counter() - t0
+
+
+def median_ms(samples):
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("probe", nargs="?", help="image for the first-inference timing")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    args = parser.parse_args()
+
+    print("\n============================================================")
+    print("COLD START BENCHMARK")
+    print("============================================================")
+    print(f"Python:  {sys.executable}")
+    print(f"Runs:    {args.runs} fresh interpreters per row (median)")
+    print("============================================================\n")
+
+    baseline = median_ms([wall(["-c", "pass"]) for _ in range(args.runs)])
+    print(f"{'interpreter':<22} {baseline:>9.1f} ms")
+
+    print(f"\n{'import':<22} {'ms':>9}  face_recognition")
+    for module in MODULES:
+        try:
+            runs = [child(IMPORT.format(module=module)) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{module:<22} {'error':>9}  {e}")
+            continue
+        print(f"{module:<22} {median_ms([r['s'] for r in runs]):>9.1f}  "
+              f"{'loaded' if runs[0]['dlib'] else 'not loaded'}")
+
+    print(f"\n{'--help':<22} {'ms':>9}")
+    for script in SCRIPTS:
+        print(f"{script:<22} {median_ms([wall([script, '--help']) for _ in range(args.runs)]):>9.1f}")
+
+    if not args.probe:
+        print("\n[INFO] Pass a probe image to time model loading and the first inference\n")
+        return
+    try:
+        cold = [child(FIRST.format(warm=False, probe=args.probe)) for _ in range(args.runs)]
+        warm = [child(FIRST.format(warm=True, probe=args.probe)) for _ in range(args.runs)]
+    except RuntimeError as e:
+        print(f"\n[ERROR] First inference failed: {e}")
+        return
+    print(f"\n{'models':<22} {'ms':>9}")
+    print(f"{'warm_up()':<22} {median_ms([r['warm'] for r in warm]):>9.1f}")
+    print(f"{'first inference cold':<22} {median_ms([r['s'] for r in cold]):>9.1f}")
+    print(f"{'first inference warm':<22} {median_ms([r['s'] for r in warm]):>9.1f}")
+    print(f"{'load to result':<22} {median_ms([r['total'] for r in cold]):>9.1f}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Offline recall/latency benchmark for the approximate (IVF) index.
+
+Usage:
+    bench_index.py <encodings_path> [--holdout 0.2] [--nprobe 1 2 4 8 16]
+    bench_index.py --synthetic 200000 [--nprobe ...]
+
+With an encodings path the per-image encodings recorded in the encode_db
+manifest are split per student: held-out images become probes, the rest
+the gallery. Each IVF setting is compared against the exact scan.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from face_index import ExactIndex, IVFIndex
+from gallery import Gallery
+
+
+def split_manifest(encodings_path, holdout):
+    import encode_db
+
+    entries = encode_db.load_manifest(encode_db.manifest_path_for(encodings_path))
+    per_student = {}
+    for key in sorted(entries):
+        entry = entries[key]
+        if entry["encoding"] is not None:
+            per_student.setdefault(entry["id"], []).append(entry["encoding"])
+
+    enrol_enc, enrol_ids, probes = [], [], []
+    step = max(2, int(round(1 / holdout))) if holdout > 0 else 0
+    for sid, encs in per_student.items():
+        for i, enc in enumerate(encs):
+            if step and i % step == step - 1:
+                probes.append(enc)
+            else:
+                enrol_enc.append(enc)
+                enrol_ids.append(sid)
+    return Gallery.from_lists(enrol_enc, enrol_ids), np.array(probes, dtype=np.float32)
+
+
+def split_synthetic(n, probes_count=500, seed=0):
+    rng = np.random.default_rng(seed)
+    students = max(1, n // 20)
+    centres = rng.normal(0, 0.09, (students, 128))
+    ids = np.arange(n) % students
+    encodings = centres[ids] + rng.normal(0, 0.02, (n, 128))
+    probe_ids = rng.integers(0, students, probes_count)
+    probes = centres[probe_ids] + rng.normal(0, 0.02, (probes_count, 128))
+    return Gallery.from_lists(list(encodings), [str(i) for i in ids]), probes.astype(np.float32)
+
+
+def per_query(index, probes):
+    t0 = time.perf_counter()
+    rows = np.empty(len(probes), dtype=np.int64)
+    for i, p in enumerate(probes):
+        rows[i] = index.search(p)[0][0]
+    return rows, (time.perf_counter() - t0) / max(len(probes), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("encodings", nargs="?")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N synthetic encodings")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+    if not args.encodings and not args.synthetic:
+        parser.error("give an encodings path or --synthetic N")
+
+    if args.synthetic:
+        gallery, probes = split_synthetic(args.synthetic)
+    else:
+        gallery, probes = split_manifest(args.encodings, args.holdout)
+    if len(probes) == 0 or len(gallery) == 0:
+        print("[ERROR] Not enough encodings to split into gallery and probes")
+        return
+
+    exact = ExactIndex(gallery)
+    ref_rows, exact_ms = per_query(exact, probes)
+    ref_ids = gallery.index[ref_rows]
+
+    t0 = time.perf_counter()
+    ivf = IVFIndex.build(gallery, nlist=args.nlist)
+    build_s = time.perf_counter() - t0
+
+    print("\n============================================================")
+    print("INDEX RECALL / LATENCY BENCHMARK")
+    print("============================================================")
+    print(f"Gallery: {len(gallery)} encodings, {len(gallery.labels)} students")
+    print(f"Probes:  {len(probes)}")
+    print(f"IVF:     {len(ivf.centres)} lists, built in {build_s:.2f}s")
+    print("============================================================\n")
+    print(f"{'backend':<14} {'ms/query':>9} {'speed-up':>9} {'recall@1':>9} {'same id':>8}")
+    print(f"{'exact':<14} {exact_ms*1000:>9.3f} {1.0:>8.1f}x {100.0:>8.1f}% {100.0:>7.1f}%")
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        rows, ms = per_query(ivf, probes)
+        recall = np.mean(rows == ref_rows) * 100
+        same_id = np.mean(gallery.index[rows] == ref_ids) * 100
+        print(f"{'ivf nprobe=' + str(nprobe):<14} {ms*1000:>9.3f} {exact_ms / ms:>8.1f}x "
+              f"{recall:>8.1f}% {same_id:>7.1f}%")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Throughput of /api/recognize-frames work in-process vs. a worker pool.
+
+Usage:
+    bench_shard.py [encodings_path] [dataset] [--workers 1 2 4] [--clients 8]
+                   [--requests 64] [--synthetic 0]
+
+Client threads send JPEG frames made from the dataset images, the way the
+browser uploads them, to: the RecognitionEngine in this process (what
+app.py does with FRAS_RECOGNITION_WORKERS=0), and a RecognitionPool in
+replicate and shard mode for each worker count. Every request gets its
+own faint noise so the encoding cache never answers for it.
+
+--synthetic adds that many random encodings to the gallery, to see when
+matching (rather than detection and encoding) starts to matter and
+sharding pays off.
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from encode_db import DATASET
+from engine import RecognitionEngine
+from gallery import DIM, Gallery
+from recognition_pool import RecognitionPool
+
+HERE = Path(__file__).resolve().parent
+
+
+def make_blobs(dataset, count, limit=16):
+    paths = sorted(Path(dataset).glob("*/*.jpg"))[:limit]
+    images = [cv2.imread(str(p)) for p in paths]
+    images = [image for image in images if image is not None]
+    if not images:
+        return []
+    rng = np.random.default_rng(0)
+    blobs = []
+    for i in range(count):
+        image = images[i % len(images)].astype(np.int16)
+        noisy = np.clip(image + rng.integers(-2, 3, image.shape), 0, 255).astype(np.uint8)
+        blobs.append(cv2.imencode(".jpg", noisy)[1].tobytes())
+    return blobs
+
+
+def pad_gallery(encodings_path, extra, out_dir):
+    """Copy of the gallery with `extra` random encodings from made-up students."""
+    gallery = Gallery.load(encodings_path, mmap=False)
+    rng = np.random.default_rng(1)
+    fake = rng.normal(0, 0.1, (extra, DIM)).astype(np.float32)
+    padded = gallery.append(fake, [f"synthetic{i // 20:05d}" for i in range(extra)])
+    path = Path(out_dir) / "encodings.bin"
+    padded.save(path)
+    return path
+
+
+def drive(match, blobs, clients):
+    """Send every blob once from `clients` threads; (seconds, per-request latencies)."""
+    latencies = []
+    lock = threading.Lock()
+    pending = iter(blobs)
+
+    def client():
+        while True:
+            with lock:
+                blob = next(pending, None)
+            if blob is None:
+                return
+            t0 = time.perf_counter()
+            match(blob)
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0, latencies
+
+
+def report(name, seconds, latencies, baseline=None):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))]
+    rate = len(latencies) / seconds
+    speedup = f"{rate / baseline:>8.2f}x" if baseline else f"{'':>9}"
+    print(f"{name:<16} {rate:>9.1f} {speedup} {statistics.median(latencies) * 1000:>9.1f} "
+          f"{p95 * 1000:>9.1f}")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("encodings_path", nargs="?", default=str(HERE / "encodings.bin"))
+    parser.add_argument("dataset", nargs="?", default=str(DATASET))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads")
+    parser.add_argument("--requests", type=int, default=64, help="frames sent per setting")
+    parser.add_argument("--synthetic", type=int, default=0, help="random encodings to add")
+    args = parser.parse_args()
+
+    blobs = make_blobs(args.dataset, args.requests)
+    if not blobs:
+        print(f"[ERROR] No images found in {args.dataset}")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.encodings_path
+        if args.synthetic:
+            path = pad_gallery(path, args.synthetic, tmp)
+        engine = RecognitionEngine(path, dataset=args.dataset).start()
+        if engine.matcher is None:
+            print(f"[ERROR] No gallery at {path}")
+            return
+
+        print("\n============================================================")
+        print("RECOGNITION WORKER BENCHMARK")
+        print("============================================================")
+        print(f"Gallery:  {len(engine.matcher.gallery)} encodings ({args.synthetic} synthetic)")
+        print(f"Requests: {len(blobs)} frames from {args.clients} client threads")
+        print("============================================================\n")
+        print(f"{'setting':<16} {'frames/s':>9} {'speed-up':>9} {'p50 ms':>9} {'p95 ms':>9}")
+
+        def in_process(blob):
+            image = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+            return engine.match_image(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+        baseline = report("in-process", *drive(in_process, blobs, args.clients))
+        for mode in ("replicate", "shard"):
+            for n in args.workers:
+                pool = RecognitionPool(engine, n, mode).start()
+                try:
+                    pool.match_blobs(blobs[:n])     # models loaded, gallery attached
+                    seconds, latencies = drive(lambda b: pool.match_blobs([b]), blobs, args.clients)
+                finally:
+                    pool.close()
+                report(f"{mode} x{n}", seconds, latencies, baseline)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Offline accuracy and latency benchmark for the recognition pipeline.
+
+Usage:
+    benchmark.py [dataset] [--probe-fraction 0.2] [--output benchmark.json]
+                 [--compare previous.json] [--thresholds 0.25 0.3 0.35 ...]
+
+Each student's images are split: most are enrolled the way encode_db.py
+encodes them, the rest become probes that go through the recognition
+path headless (load, detect, encode, match) with per-stage timings.
+
+Accuracy is measured for every probe against the whole gallery:
+  FRR   probes not accepted as their own student (no face found, too far
+        or matched to someone else)
+  MISID probes accepted as a different student
+  FAR   probes whose closest *other* student is within the threshold,
+        i.e. how often they would be accepted if they were not enrolled
+Results go to a JSON file; --compare prints the change against an earlier
+run.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import detection
+import encode_db
+import models
+from capture import StageStats
+from face_index import build_index
+from gallery import Gallery
+
+DEFAULT_THRESHOLDS = [0.25, 0.275, 0.3, 0.325, 0.35, 0.375, 0.4, 0.425, 0.45, 0.5]
+THRESHOLD = 0.35
+
+
+def split_dataset(dataset, probe_fraction):
+    """({id: [enrol paths]}, [(id, probe path)]); every n-th image of a student is a probe."""
+    step = max(2, int(round(1 / probe_fraction))) if probe_fraction > 0 else 0
+    enrol, probes = {}, []
+    for student_dir in sorted(p for p in Path(dataset).iterdir() if p.is_dir()):
+        for i, path in enumerate(sorted(student_dir.glob("*.jpg"))):
+            if step and i % step == step - 1:
+                probes.append((student_dir.name, path))
+            else:
+                enrol.setdefault(student_dir.name, []).append(path)
+    return enrol, probes
+
+
+def enrol_gallery(enrol):
+    encodings, ids = [], []
+    for sid, paths in enrol.items():
+        for path in paths:
+            # Bypass the encoding cache: a warm cache would make every run
+            # after the first measure disk reads instead of the encoder
+            image = models.load_image_file(str(path))
+            encoding, _ = encode_db.encode_array(image, encode_db.read_sidecar(path), cache=False)
+            if encoding is not None:
+                encodings.append(encoding)
+                ids.append(sid)
+    return Gallery.from_lists(encodings, ids)
+
+
+def run_probe(path, matcher, stats, use_sidecars):
+    """Encoding of the probe's largest face (or None), matched with the index."""
+    with stats.time("load"):
+        rgb = models.load_image_file(str(path))
+    box = encode_db.read_sidecar(path) if use_sidecars else None
+    if box is None:
+        with stats.time("resize"):
+            small, scale = detection.DATASET.shrink(rgb)
+        with stats.time("detect"):
+            boxes = detection.to_full(detection.DATASET.locate(small), scale, rgb.shape)
+        if not boxes:
+            return None
+        box = max(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+    with stats.time("encode"):
+        encodings = models.face_encodings(rgb, [box])
+    if not encodings:
+        return None
+    with stats.time("match"):
+        matcher.match(encodings, THRESHOLD)
+    return encodings[0]
+
+
+def scores(gallery, probe_ids, encodings):
+    """Per probe: closest student, its distance, and the closest other-student distance."""
+    ids = np.array(gallery.ids)
+    out = []
+    for sid, enc in zip(probe_ids, encodings):
+        if enc is None:
+            out.append((None, np.inf, np.inf))
+            continue
+        d = gallery.distances(enc)[0]
+        best = int(d.argmin())
+        others = d[ids != sid]
+        out.append((ids[best], float(d[best]), float(others.min()) if len(others) else np.inf))
+    return out
+
+
+def rates(probe_ids, probe_scores, threshold):
+    n = len(probe_ids)
+    accepted = sum(1 for sid, (best, d, _) in zip(probe_ids, probe_scores) if best == sid and d < threshold)
+    misid = sum(1 for sid, (best, d, _) in zip(probe_ids, probe_scores)
+                if best is not None and best != sid and d < threshold)
+    false_accepts = sum(1 for _, _, other in probe_scores if other < threshold)
+    encoded = sum(1 for best, _, _ in probe_scores if best is not None)
+    return {
+        "threshold": round(threshold, 4),
+        "tar": accepted / n if n else 0.0,
+        "frr": 1 - accepted / n if n else 0.0,
+        "misid": misid / n if n else 0.0,
+        "far": false_accepts / encoded if encoded else 0.0,
+    }
+
+
+def equal_error_rate(probe_ids, probe_scores):
+    grid = [rates(probe_ids, probe_scores, t) for t in np.arange(0.0, 1.0, 0.005)]
+    best = min(grid, key=lambda r: abs(r["far"] - r["frr"]))
+    return {"threshold": best["threshold"], "rate": (best["far"] + best["frr"]) / 2}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=Path(__file__).resolve().parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(dataset, probe_fraction, thresholds, use_sidecars):
+    enrol, probes = split_dataset(dataset, probe_fraction)
+    if not enrol or not probes:
+        raise ValueError(f"not enough images in {dataset} to split into enrol and probe sets")
+
+    t0 = time.perf_counter()
+    gallery = enrol_gallery(enrol)
+    enrol_s = time.perf_counter() - t0
+    matcher = build_index(gallery)
+
+    stats = StageStats()
+    t0 = time.perf_counter()
+    encodings = [run_probe(path, matcher, stats, use_sidecars) for _, path in probes]
+    probe_s = time.perf_counter() - t0
+
+    probe_ids = [sid for sid, _ in probes]
+    probe_scores = scores(gallery, probe_ids, encodings)
+    return {
+        "run": {
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "commit": git_commit(),
+            "dataset": str(Path(dataset).resolve()),
+            "students": len(enrol),
+            "enrolled": len(gallery),
+            "probes": len(probes),
+            "no_face": sum(1 for e in encodings if e is None),
+            "index": matcher.kind,
+            "probe_sidecars": use_sidecars,
+        },
+        "latency_ms": stats.summary(),
+        "throughput": {
+            "probes_per_s": len(probes) / probe_s if probe_s else 0.0,
+            "enrol_images_per_s": sum(map(len, enrol.values())) / enrol_s if enrol_s else 0.0,
+        },
+        "accuracy": {
+            "at_threshold": rates(probe_ids, probe_scores, THRESHOLD),
+            "roc": [rates(probe_ids, probe_scores, t) for t in thresholds],
+            "eer": equal_error_rate(probe_ids, probe_scores),
+        },
+    }
+
+
+def report(result):
+    r = result["run"]
+    print("\n============================================================")
+    print("RECOGNITION BENCHMARK")
+    print("============================================================")
+    print(f"Dataset:    {r['dataset']} ({r['students']} students)")
+    print(f"Enrolled:   {r['enrolled']} encodings ({r['index']} index)")
+    print(f"Probes:     {r['probes']} ({r['no_face']} without a face)")
+    print(f"Throughput: {result['throughput']['probes_per_s']:.1f} probes/s, "
+          f"{result['throughput']['enrol_images_per_s']:.1f} enrol images/s")
+    print("============================================================\n")
+    print(f"{'stage':<10} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, s in result["latency_ms"].items():
+        print(f"{stage:<10} {s['count']:>7} {s['mean_ms']:>9.2f} {s['p50_ms']:>9.2f} "
+              f"{s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}")
+    print(f"\n{'threshold':>9} {'TAR':>7} {'FRR':>7} {'MISID':>7} {'FAR':>7}")
+    for row in result["accuracy"]["roc"]:
+        mark = "  <- default" if abs(row["threshold"] - THRESHOLD) < 1e-9 else ""
+        print(f"{row['threshold']:>9.3f} {row['tar']:>7.1%} {row['frr']:>7.1%} "
+              f"{row['misid']:>7.1%} {row['far']:>7.1%}{mark}")
+    eer = result["accuracy"]["eer"]
+    print(f"\nEER: {eer['rate']:.1%} at threshold {eer['threshold']:.3f}\n")
+
+
+def compare(old, new):
+    def change(a, b):
+        return f"{a:>9.2f} -> {b:>9.2f} ({(b - a) / a * 100:+.0f}%)" if a else f"{a:>9.2f} -> {b:>9.2f}"
+
+    print("============================================================")
+    print(f"COMPARED WITH {old['run']['time']} (commit {old['run'].get('commit') or '?'})")
+    print("============================================================")
+    for stage, s in new["latency_ms"].items():
+        if stage in old["latency_ms"]:
+            for k in ("p50_ms", "p95_ms", "p99_ms"):
+                print(f"{stage + ' ' + k:<16} {change(old['latency_ms'][stage][k], s[k])}")
+    print(f"{'probes/s':<16} {change(old['throughput']['probes_per_s'], new['throughput']['probes_per_s'])}")
+    a, b = old["accuracy"]["at_threshold"], new["accuracy"]["at_threshold"]
+    for k in ("frr", "misid", "far"):
+        print(f"{k.upper() + ' @' + str(THRESHOLD):<16} {a[k]:>9.1%} -> {b[k]:>9.1%}")
+    print(f"{'EER':<16} {old['accuracy']['eer']['rate']:>9.1%} -> {new['accuracy']['eer']['rate']:>9.1%}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dataset", nargs="?", default=str(encode_db.DATASET))
+    parser.add_argument("--probe-fraction", type=float, default=0.2)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--probe-sidecars", action="store_true",
+                        help="use registration face boxes for probes instead of detecting")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier benchmark JSON to compare against")
+    args = parser.parse_args()
+
+    try:
+        result = run(args.dataset, args.probe_fraction, args.thresholds, args.probe_sidecars)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        return 1
+    report(result)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"[OK] Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
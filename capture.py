@@ -0,0 +1,311 @@
+"""Shared frame capture for register.py and recognize.py.
+
+A producer thread reads the source and keeps only the newest frame, so the
+camera buffer never fills up behind slow detection; consumer threads take
+whatever frame is newest when they become free. Sources can be a camera
+index, a video file, or an image sequence (folder or glob), which makes the
+pipeline benchmarkable headless:
+
+    capture.py <source> <encodings_path> [--workers N] [--threshold 0.35]
+"""
+import argparse
+import glob
+import os
+import queue
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+
+import metrics
+
+STAGES = ("capture", "load", "resize", "detect", "track", "quality", "encode", "match")
+
+
+class StageStats:
+    """Thread-safe per-stage timings (seconds)."""
+
+    def __init__(self):
+        self._times = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._times.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t0)
+
+    def summary(self):
+        with self._lock:
+            times = {k: sorted(v) for k, v in self._times.items()}
+        out = {}
+        for stage in sorted(times, key=lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s)):
+            v = times[stage]
+            out[stage] = {
+                "count": len(v),
+                "mean_ms": statistics.mean(v) * 1000,
+                "p50_ms": v[len(v) // 2] * 1000,
+                "p95_ms": v[min(len(v) - 1, int(0.95 * len(v)))] * 1000,
+                "p99_ms": v[min(len(v) - 1, int(0.99 * len(v)))] * 1000,
+            }
+        return out
+
+    def report(self):
+        print(f"{'stage':<10} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for stage, s in self.summary().items():
+            print(f"{stage:<10} {s['count']:>7} {s['mean_ms']:>9.2f} {s['p50_ms']:>9.2f} "
+                  f"{s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}")
+
+
+def stage(stats, name):
+    # Timing span for /metrics, also added to `stats` when one is attached
+    return metrics.span(name, stats)
+
+
+class ImageSequence:
+    """cv2.VideoCapture-like reader over a folder or glob of images."""
+
+    def __init__(self, pattern):
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        exts = (".jpg", ".jpeg", ".png", ".bmp")
+        self.paths = sorted(p for p in glob.glob(pattern) if p.lower().endswith(exts))
+        self.pos = 0
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def read(self):
+        while self.pos < len(self.paths):
+            frame = cv2.imread(self.paths[self.pos])
+            self.pos += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def release(self):
+        self.pos = len(self.paths)
+
+
+def open_source(source, width=640, height=480):
+    """Open a camera index, video file or image sequence; returns (cap, live)."""
+    if isinstance(source, int) or str(source).isdigit():
+        cap = cv2.VideoCapture(int(source))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap, True
+    if os.path.isdir(source) or any(c in str(source) for c in "*?["):
+        return ImageSequence(str(source)), False
+    return cv2.VideoCapture(str(source)), False
+
+
+class LatestFrame:
+    """Single-slot queue: put() replaces any unread frame (drop-old).
+
+    With drop=False put() waits until the previous frame was taken, so file
+    sources are processed frame by frame instead of as fast as they decode.
+    """
+
+    def __init__(self, drop=True):
+        self.drop = drop
+        self.dropped = 0
+        self._frame = None
+        self._seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, frame):
+        with self._cond:
+            while not self.drop and self._frame is not None and not self._closed:
+                self._cond.wait()
+            if self._frame is not None:
+                self.dropped += 1
+            self._seq += 1
+            self._frame = frame
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """Newest (seq, frame), or None once closed and drained."""
+        with self._cond:
+            while self._frame is None and not self._closed:
+                if not self._cond.wait(timeout):
+                    return None
+            if self._frame is None:
+                return None
+            frame, self._frame = self._frame, None
+            self._cond.notify_all()
+            return self._seq, frame
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class CaptureThread(threading.Thread):
+    """Producer: reads frames as fast as the source delivers them."""
+
+    def __init__(self, cap, slot, stats=None, live=True):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.slot = slot
+        self.stats = stats
+        self.live = live
+        self.frames = 0
+        self._halt = threading.Event()
+
+    def run(self):
+        failures = 0
+        while not self._halt.is_set():
+            with stage(self.stats, "capture"):
+                ret, frame = self.cap.read()
+            if not ret:
+                # Cameras hiccup, files end
+                failures += 1
+                if not self.live or failures > 100:
+                    break
+                time.sleep(0.01)
+                continue
+            failures = 0
+            self.frames += 1
+            self.slot.put(frame)
+        self.slot.close()
+
+    def stop(self):
+        self._halt.set()
+        self.slot.close()
+
+
+class FramePipeline:
+    """Capture thread + pool of consumer threads running `process(frame)`.
+
+    Iterating yields (seq, frame, result) in completion order. For live
+    sources, results for frames older than one already yielded are
+    discarded; file sources yield every frame.
+    """
+
+    def __init__(self, source, process, workers=1, stats=None, drop=None):
+        self.cap, live = open_source(source)
+        if not self.cap.isOpened():
+            raise IOError(f"could not open video source {source!r}")
+        self.process = process
+        self.stats = stats
+        self.slot = LatestFrame(drop=live if drop is None else drop)
+        self.capture = CaptureThread(self.cap, self.slot, stats, live)
+        self.results = queue.Queue(maxsize=workers * 2)
+        self.workers = [threading.Thread(target=self._consume, daemon=True) for _ in range(workers)]
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def _consume(self):
+        while True:
+            item = self.slot.get(timeout=0.5)
+            if item is None:
+                if self.slot.closed:
+                    break
+                continue
+            seq, frame = item
+            self.results.put((seq, frame, self.process(frame)))
+        with self._lock:
+            self._running -= 1
+            if self._running == 0:
+                self.results.put(None)
+
+    def __enter__(self):
+        self._running = len(self.workers)
+        self.capture.start()
+        for w in self.workers:
+            w.start()
+        return self
+
+    def __iter__(self):
+        last = 0
+        while True:
+            item = self.results.get()
+            if item is None:
+                return
+            if self.slot.drop and item[0] < last:
+                continue
+            last = item[0]
+            yield item
+
+    def __exit__(self, *exc):
+        self.capture.stop()
+        self.capture.join(timeout=2)
+        self.cap.release()
+        # Unblock consumers waiting on a full results queue
+        while any(w.is_alive() for w in self.workers):
+            try:
+                self.results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless capture/recognition benchmark")
+    parser.add_argument("source", help="camera index, video file, or image folder/glob")
+    parser.add_argument("encodings_path")
+    parser.add_argument("--threshold", type=float, default=0.35)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--scale", type=float, default=None,
+                        help="fixed detection scale (default: chosen from the frame size)")
+    parser.add_argument("--upsample", type=int, default=0)
+    args = parser.parse_args()
+
+    import models
+    import recognize
+    from detection import DetectionPolicy, to_full
+
+    matcher = recognize.load_matcher(args.encodings_path)
+    policy = DetectionPolicy(upsample=args.upsample, scale=args.scale)
+    stats = StageStats()
+
+    def process(frame):
+        with stats.time("resize"):
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            small, scale = policy.shrink(rgb)
+        with stats.time("detect"):
+            boxes = to_full(policy.locate(small), scale, rgb.shape)
+        if not boxes:
+            return []
+        with stats.time("encode"):
+            encs = models.face_encodings(rgb, boxes)
+        with stats.time("match"):
+            return matcher.match(encs, args.threshold)
+
+    t0 = time.perf_counter()
+    frames = matched = 0
+    with FramePipeline(args.source, process, workers=args.workers, stats=stats) as pipe:
+        for _, _, matches in pipe:
+            frames += 1
+            matched += sum(1 for sid, _ in matches if sid is not None)
+        dropped = pipe.slot.dropped
+    wall = time.perf_counter() - t0
+
+    print("\n============================================================")
+    print("CAPTURE PIPELINE BENCHMARK")
+    print("============================================================")
+    print(f"Source:  {args.source}")
+    print(f"Frames:  {frames} processed, {dropped} dropped, {frames / wall:.1f} fps")
+    print(f"Matches: {matched}")
+    print("============================================================\n")
+    stats.report()
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Face detection at a resolution chosen from the image size.
+
+HOG (dlib's frontal face detector) slides an 80x80 window, so it finds
+faces from roughly that size up; each upsample halves that. Its cost grows
+with the pixel count, so an image is shrunk until the smallest face we
+expect to find just fills the window. Boxes are mapped back to the
+original image so encodings are computed at full resolution.
+"""
+import math
+
+import cv2
+
+import models
+
+HOG_WINDOW = 80
+MIN_SCALE = 0.05
+
+
+class DetectionPolicy:
+    """How far to shrink an image before running the detector.
+
+    `face_fraction` is the smallest face to find as a fraction of the
+    image's shorter side, or `min_face` the same in pixels. `upsample` is
+    face_recognition's number_of_times_to_upsample. `scale` fixes the
+    detection scale instead of deriving it.
+    """
+
+    def __init__(self, face_fraction=1 / 3, min_face=None, upsample=0, scale=None, model="hog"):
+        self.face_fraction = face_fraction
+        self.min_face = min_face
+        self.upsample = upsample
+        self.scale = scale
+        self.model = model
+
+    def scale_for(self, shape):
+        if self.scale is not None:
+            return self.scale
+        face = self.min_face or self.face_fraction * min(shape[:2])
+        window = HOG_WINDOW / (2 ** self.upsample)
+        # Round up to 1/20 steps so similar sizes share a scale; never enlarge
+        scale = math.ceil(window / max(face, 1) * 20) / 20
+        return min(1.0, max(MIN_SCALE, scale))
+
+    def shrink(self, image):
+        """(image resized for detection, scale used)."""
+        scale = self.scale_for(image.shape)
+        if scale >= 1.0:
+            return image, 1.0
+        return cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+    def locate(self, small):
+        """Boxes in an image already shrunk by shrink()."""
+        return models.face_locations(
+            small, number_of_times_to_upsample=self.upsample, model=self.model)
+
+    def detect(self, rgb):
+        """Face boxes (top, right, bottom, left) in full-resolution coordinates."""
+        small, scale = self.shrink(rgb)
+        return to_full(self.locate(small), scale, rgb.shape)
+
+
+def to_full(boxes, scale, shape):
+    # Map boxes found at `scale` back to an image of `shape`, clipped to it
+    h, w = shape[:2]
+    return [(max(0, int(round(top / scale))), min(w, int(round(right / scale))),
+             min(h, int(round(bottom / scale))), max(0, int(round(left / scale))))
+            for top, right, bottom, left in boxes]
+
+
+# Camera frames at a kiosk: the face fills about a third of the frame or
+# more (0.5x on a 640x480 webcam, less on HD cameras)
+CAMERA = DetectionPolicy(face_fraction=1 / 3)
+
+# Classroom sessions see the whole room, so faces are smaller
+SESSION = DetectionPolicy(face_fraction=1 / 6)
+
+# Dataset images: registration crops (mostly skipped via sidecars) and
+# uploaded photos, which can be several megapixels
+DATASET = DetectionPolicy(face_fraction=1 / 5)
@@ -1,84 +1,514 @@
-import face_recognition
 from pathlib import Path
-import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import concurrent.futures
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import struct
 import sys
+import time
+
+import numpy as np
+
+import detection
+import encoding_cache
+import models
+from face_index import build_index, index_path_for, load_index, save_index
+from gallery import DIM, Gallery, atomic_file, gallery_lock
 
 # Paths
 ROOT = Path(__file__).resolve().parent.parent
 DATASET = ROOT / "dataset"
 
-def encode_db(output_path):
+# Manifest layout (little endian): header (magic, version, JSON length,
+# encoding count), UTF-8 JSON of the per-image entries with the row of
+# their encoding (or null), then the float64 encodings, count x dim.
+# Version 1 was a pickle; it is never loaded, the next run re-encodes.
+MANIFEST_VERSION = 2
+MANIFEST_MAGIC = b"FRASMAN\0"
+MANIFEST_HEADER = struct.Struct("<8sIQQ")
+
+# Most images handed to one worker task
+CHUNK_SIZE = 32
+
+# Longest one uploaded image may take in an encode_blobs() worker
+BLOB_TIMEOUT = 60
+
+
+def manifest_path_for(output_path):
+    # Manifest lives next to the encodings file
+    return Path(str(output_path) + ".manifest")
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(path):
+    # Missing, legacy or unreadable manifest means a full rebuild
+    try:
+        with open(path, "rb") as f:
+            head = f.read(MANIFEST_HEADER.size)
+            if len(head) < MANIFEST_HEADER.size or head[:len(MANIFEST_MAGIC)] != MANIFEST_MAGIC:
+                print(f"[WARN] {path} is not a binary manifest (legacy pickle?) - "
+                      f"re-encoding every image")
+                return {}
+            _, version, meta_len, count = MANIFEST_HEADER.unpack(head)
+            if version != MANIFEST_VERSION:
+                return {}
+            entries = json.loads(f.read(meta_len).decode("utf-8"))
+            block = np.fromfile(f, "<f8", count * DIM).reshape(count, DIM)
+        for entry in entries.values():
+            row = entry.pop("row")
+            entry["encoding"] = block[row] if row is not None else None
+        return entries
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"[WARN] Could not read {path} ({e}) - re-encoding every image")
+        return {}
+
+
+def save_manifest(entries, path):
+    # JSON for the stamps, one binary block for the encodings; never pickle
+    meta, rows = {}, []
+    for key, entry in entries.items():
+        encoding = entry.get("encoding")
+        meta[key] = {k: v for k, v in entry.items() if k != "encoding"}
+        meta[key]["row"] = len(rows) if encoding is not None else None
+        if encoding is not None:
+            rows.append(encoding)
+    body = json.dumps(meta).encode("utf-8")
+    block = np.asarray(rows, dtype="<f8").reshape(len(rows), DIM)
+    with atomic_file(path) as f:
+        f.write(MANIFEST_HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION, len(body), len(rows)))
+        f.write(body)
+        f.write(block.tobytes())
+
+
+def sidecar_path(img_path):
+    # dataset/<id>/<id>_3.jpg -> dataset/<id>/<id>_3.json
+    return Path(img_path).with_suffix(".json")
+
+
+def write_sidecar(img_path, box):
+    """Record the face box (top, right, bottom, left) of a saved image."""
+    with open(sidecar_path(img_path), "w") as f:
+        json.dump({"box": [int(v) for v in box]}, f)
+
+
+def read_sidecar(img_path):
+    # Known face box for the image, or None to fall back to detection
+    try:
+        with open(sidecar_path(img_path), "r") as f:
+            top, right, bottom, left = json.load(f)["box"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if bottom <= top or right <= left:
+        return None
+    return (top, right, bottom, left)
+
+
+def sidecar_stamp(img_path):
+    try:
+        return sidecar_path(img_path).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def encode_image(img_path):
+    """Encoding of the face in an image and whether a known crop box was used."""
+    # Load image
+    image = models.load_image_file(str(img_path))
+    return encode_array(image, read_sidecar(img_path))
+
+
+def encode_array(image, box=None, cache=True):
+    # Known-crop mode: registration recorded the face box, skip detection
+    if box is not None:
+        h, w = image.shape[:2]
+        box = (max(0, box[0]), min(w, box[1]), min(h, box[2]), max(0, box[3]))
+        boxes = [box]
+    else:
+        # Detect faces on a copy shrunk to the size the detector needs
+        boxes = detection.DATASET.detect(image)
+        if len(boxes) == 0:
+            return None, False
+
+    # Encode face (num_jitters=1 for speed); the disk cache makes full
+    # rebuilds and duplicate uploads skip unchanged crops
+    if cache:
+        enc = encoding_cache.encode(image, boxes[:1], num_jitters=1, persist=True)
+    else:
+        enc = models.face_encodings(image, boxes[:1], num_jitters=1)
+    if len(enc) == 0:
+        return None, box is not None
+    return enc[0], box is not None
+
+
+def encode_chunk(chunk):
+    # Worker entry point: encode one student folder's pending images
+    t0 = time.perf_counter()
+    results = [(key, file_hash(path)) + encode_image(path) for key, path in chunk]
+    return os.getpid(), time.perf_counter() - t0, results
+
+
+def as_jpeg(data, quality=95):
+    """Upload bytes as they are saved in the dataset, which rescans read as *.jpg.
+
+    JPEG passes through untouched; PNG and other formats are re-encoded.
+    Bytes that do not decode are returned as they are (encode_blob rejects them).
+    """
+    if data[:3] == b"\xff\xd8\xff":
+        return data
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            out = io.BytesIO()
+            image.convert("RGB").save(out, "JPEG", quality=quality)
+    except Exception:
+        return data
+    return out.getvalue()
+
+
+def encode_blob(item):
+    # Worker entry point for uploads: (key, jpeg bytes, face box or None)
+    key, data, box = item
+    digest = hashlib.sha1(data).hexdigest()
+    try:
+        # Same decoder as encode_image, so a later rescan finds identical pixels
+        image = models.load_image_file(io.BytesIO(data))
+    except Exception:
+        return key, digest, None, False
+    return (key, digest) + encode_array(image, box)
+
+
+def spawn_pool(workers):
+    """Process pool for encode_blobs() that is safe to start from a threaded server.
+
+    Spawned rather than forked: a forked child could inherit a lock another
+    thread held at that moment and deadlock on it.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def discard_pool(pool):
+    """Shut down a pool whose worker hung or died, without waiting for it."""
+    # Executor.shutdown() cannot stop a task that is running; end the processes
+    for proc in list((getattr(pool, "_processes", None) or {}).values()):
+        proc.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def encode_blobs(items, workers=1, pool=None, timeout=BLOB_TIMEOUT):
+    """Yield (key, sha1, encoding, known_crop) per (key, bytes, box), in input order.
+
+    `items` may be a generator (e.g. over an upload being read); at most a
+    few images per worker are held in memory at a time. `pool` (from
+    spawn_pool) is reused if given, otherwise one is started for this call.
+    Raises TimeoutError if a worker spends over `timeout` seconds on one image.
+    """
+    if workers == 1 and pool is None:
+        yield from map(encode_blob, items)
+        return
+    executor = pool or spawn_pool(workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(encode_blob, item))
+            if len(pending) >= workers * 4:
+                yield _blob_result(pending.popleft(), timeout)
+        while pending:
+            yield _blob_result(pending.popleft(), timeout)
+    finally:
+        for future in pending:
+            future.cancel()
+        if pool is None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _blob_result(future, timeout):
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        # Distinct from the builtin TimeoutError before Python 3.11
+        raise TimeoutError(f"encoding an uploaded image took over {timeout}s")
+
+
+def append_encodings(output_path, results):
+    """Add already-encoded images to gallery, manifest and index without a rescan.
+
+    `results` holds (key, student id, sha1, size, encoding) for images that
+    will be saved under dataset/<key>; keys already in the manifest are
+    skipped. Returns the number of rows appended.
+    """
+    output_path = Path(output_path).resolve()
+    with gallery_lock(output_path):
+        return _append_encodings(output_path, results)
+
+
+def _append_encodings(output_path, results):
+    manifest_path = manifest_path_for(output_path)
+    index_path = index_path_for(output_path)
+
+    entries = load_manifest(manifest_path)
+    fresh = [r for r in results if r[0] not in entries and r[4] is not None]
+    if not fresh:
+        return 0
+
+    encodings = [r[4] for r in fresh]
+    ids = [r[1] for r in fresh]
+    provenance = [{"path": r[0], "sha1": r[2]} for r in fresh]
+    if output_path.exists():
+        old = Gallery.load(output_path)
+        gallery = old.append(encodings, ids, provenance)
+        # Extend the existing index rather than retraining it
+        idx = load_index(index_path, old).extend(gallery)
+    else:
+        gallery = Gallery.from_lists(encodings, ids, provenance)
+        idx = build_index(gallery)
+    save_index(idx, gallery, index_path)
+    gallery.save(output_path)
+
+    # mtime is unknown until the image is written; record_files() fills it in
+    for key, sid, digest, size, encoding in fresh:
+        entries[key] = {"id": sid, "mtime": None, "size": size, "sidecar": None,
+                        "sha1": digest, "encoding": encoding}
+    save_manifest(entries, manifest_path)
+    return len(fresh)
+
+
+def record_files(output_path, dataset, keys):
+    """Store the on-disk stamps of freshly written images so rescans skip them."""
+    output_path = Path(output_path).resolve()
+    manifest_path = manifest_path_for(output_path)
+    with gallery_lock(output_path):
+        entries = load_manifest(manifest_path)
+        updated = 0
+        for key in keys:
+            path = Path(dataset) / key
+            if key not in entries or not path.exists():
+                continue
+            st = path.stat()
+            entries[key].update(mtime=st.st_mtime_ns, size=st.st_size, sidecar=sidecar_stamp(path))
+            updated += 1
+        if updated:
+            save_manifest(entries, manifest_path)
+    return updated
+
+
+def encode_chunks(work, workers=1):
+    """Yield (key, sha1, encoding, known_crop) for every pending image, in input order."""
+    if not work:
+        return
+
+    stats = {}
+    t0 = time.perf_counter()
+    if workers == 1 or len(work) == 1:
+        done = map(encode_chunk, work)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        # map() returns chunks in submission order, so the merge is deterministic
+        done = pool.map(encode_chunk, work)
+    try:
+        for pid, elapsed, results in done:
+            images, busy = stats.get(pid, (0, 0.0))
+            stats[pid] = (images + len(results), busy + elapsed)
+            yield from results
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    wall = time.perf_counter() - t0
+
+    total = sum(images for images, _ in stats.values())
+    print(f"\nWorker throughput ({len(stats)} workers, {total / wall:.1f} images/sec overall):")
+    for pid, (images, busy) in sorted(stats.items()):
+        print(f"  worker {pid}: {images} images in {busy:.1f}s -> {images / busy if busy else 0:.1f} images/sec")
+    print()
+
+
+def encode_db(output_path, dataset=DATASET, full=False, index="auto", index_params=None, workers=1,
+              progress=None):
+    """Incrementally encode the dataset into output_path; returns a summary dict or None.
+
+    `progress(done, total)` is called as pending images are encoded. Holds
+    the gallery lock file throughout, so concurrent rebuilds (web server,
+    C++ menu) run one after the other instead of racing on the output.
+    """
     output_path = Path(output_path).resolve()
+    with gallery_lock(output_path):
+        return _encode_db(output_path, Path(dataset).resolve(), full, index, index_params,
+                          workers, progress)
+
+
+def _encode_db(output_path, dataset, full, index, index_params, workers, progress):
+    manifest_path = manifest_path_for(output_path)
+    index_path = index_path_for(output_path)
 
     print("\n============================================================")
     print("FAST FACE ENCODING")
     print("============================================================")
-    print(f"Dataset: {DATASET}")
+    print(f"Dataset: {dataset}")
     print(f"Output:  {output_path}")
+    print(f"Mode:    {'full rebuild' if full else 'incremental'}, {workers} worker(s)")
     print("============================================================\n")
 
     # Check if dataset exists
-    if not DATASET.exists():
+    if not dataset.exists():
         print("[ERROR] Dataset folder missing!")
-        sys.exit(1)
+        return None
 
+    old_entries = {} if full else load_manifest(manifest_path)
+    entries = {}
     known_encodings = []
     known_ids = []
-    students = list(DATASET.iterdir())
+    students = sorted(p for p in dataset.iterdir() if p.is_dir())
 
     print(f"Found {len(students)} students")
     print("Encoding faces (fast mode)...\n")
 
-    # Process each student folder
-    for student_dir in students:
-        if not student_dir.is_dir():
-            continue
+    reused = encoded = touched = cropped = 0
 
+    # Pass 1: decide per image whether the manifest entry can be reused
+    layout = []
+    work = []
+    for student_dir in students:
         sid = student_dir.name
-        imgs = list(student_dir.glob("*.jpg"))
+        imgs = sorted(student_dir.glob("*.jpg"))
+        keys = []
+        todo = []
+        for img_path in imgs:
+            key = img_path.relative_to(dataset).as_posix()
+            st = img_path.stat()
+            crop = sidecar_stamp(img_path)
+            old = old_entries.get(key)
+            keys.append(key)
 
+            # A sidecar appearing, changing or vanishing means re-encode
+            if old is not None and old.get("sidecar") == crop:
+                if old["mtime"] == st.st_mtime_ns and old["size"] == st.st_size:
+                    # Unchanged on disk - reuse without reading the file
+                    entries[key] = old
+                    reused += 1
+                    continue
+                # Touched or rewritten - only re-encode if content differs
+                if file_hash(img_path) == old["sha1"]:
+                    entries[key] = dict(old, mtime=st.st_mtime_ns, size=st.st_size)
+                    reused += 1
+                    touched += 1
+                    continue
+
+            entries[key] = {"id": sid, "mtime": st.st_mtime_ns, "size": st.st_size, "sidecar": crop}
+            todo.append((key, str(img_path)))
+        layout.append((sid, keys, len(todo)))
+        # Large folders are split so one student cannot serialise the pool
+        for i in range(0, len(todo), CHUNK_SIZE):
+            work.append(todo[i:i + CHUNK_SIZE])
+
+    # Pass 2: encode new/changed images, chunked by student folder
+    pending = sum(len(chunk) for chunk in work)
+    for key, digest, encoding, known_crop in encode_chunks(work, workers):
+        entries[key].update(sha1=digest, encoding=encoding)
+        encoded += 1
+        cropped += known_crop
+        if progress is not None:
+            progress(encoded, pending)
+
+    # Pass 3: merge in sorted student/image order, same as a serial run
+    provenance = []
+    for sid, keys, fresh in layout:
         count = 0
-        # Process each image
-        for img_path in imgs:
-            # Load image
-            image = face_recognition.load_image_file(str(img_path))
-            
-            # Detect faces
-            boxes = face_recognition.face_locations(image, model="hog")
-
-            if len(boxes) > 0:
-                # Encode face (num_jitters=1 for speed)
-                enc = face_recognition.face_encodings(image, boxes, num_jitters=1)
-                if len(enc) > 0:
-                    known_encodings.append(enc[0])
-                    known_ids.append(sid)
-                    count += 1
-
-        print(f"Processing {sid}: {len(imgs)} images -> ({count} faces encoded)")
+        for key in keys:
+            entry = entries[key]
+            if entry["encoding"] is not None:
+                known_encodings.append(entry["encoding"])
+                known_ids.append(sid)
+                provenance.append({"path": key, "sha1": entry["sha1"]})
+                count += 1
+        print(f"Processing {sid}: {len(keys)} images ({fresh} new/changed) -> ({count} faces encoded)")
+
+    removed = len(set(old_entries) - set(entries))
 
     # Check if any faces were encoded
     if len(known_encodings) == 0:
         print("\n[ERROR] No faces were encoded!")
-        sys.exit(1)
+        return None
 
-    # Save encodings
-    data = {"encodings": known_encodings, "ids": known_ids}
-
-    with open(output_path, "wb") as f:
-        pickle.dump(data, f)
+    # Skip the writes when nothing changed so readers watching the file do
+    # not reload. The index (derived from the gallery) goes first: a reader
+    # that sees the new gallery then also finds its index.
+    changed = full or encoded > 0 or removed > 0 or not output_path.exists()
+    gallery = Gallery.from_lists(known_encodings, known_ids, provenance)
+    index_kind = None
+    if changed or index != "auto" or not index_path.exists():
+        idx = build_index(gallery, index, **(index_params or {}))
+        save_index(idx, gallery, index_path)
+        index_kind = idx.kind
+    if changed:
+        gallery.save(output_path)
+    if changed or touched:
+        save_manifest(entries, manifest_path)
 
     print("\n============================================================")
     print("ENCODING COMPLETE")
     print("============================================================")
     print(f"Students encoded: {len(set(known_ids))}")
     print(f"Total face samples: {len(known_encodings)}")
-    print(f"Output: {output_path}")
+    print(f"Images encoded: {encoded} ({cropped} known-crop, {encoded - cropped} detected), "
+          f"reused: {reused}, removed: {removed}")
+    print(f"Output: {output_path}{'' if changed else ' (unchanged)'}")
+    if index_kind:
+        print(f"Index:  {index_path} ({index_kind})")
     print("============================================================\n")
 
+    return {
+        "students": len(set(known_ids)),
+        "samples": len(known_encodings),
+        "encoded": encoded,
+        "known_crop": cropped,
+        "reused": reused,
+        "removed": removed,
+        "changed": changed,
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Encode the face dataset")
+    parser.add_argument("paths", nargs="+", metavar="[dataset] output",
+                        help="optional dataset folder followed by the encodings output path")
+    parser.add_argument("--full", action="store_true",
+                        help="ignore the manifest and re-encode every image")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="encoding processes, 0 = one per CPU core (default: 1)")
+    parser.add_argument("--index", default="auto", choices=["auto", "exact", "ivf"],
+                        help="search index backend built next to the output (default: auto)")
+    parser.add_argument("--nlist", type=int, default=None,
+                        help="--index ivf: number of k-means partitions (default 4*sqrt(N))")
+    parser.add_argument("--nprobe", type=int, default=8,
+                        help="--index ivf: partitions scanned per query, higher = better recall")
+    args = parser.parse_args(argv)
+    if len(args.paths) > 2:
+        parser.error("expected at most two paths: [dataset] output")
+    return args
+
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("[ERROR] Usage: encode_db.py <output_path>")
-        sys.exit(1)
-    
-    encode_db(sys.argv[1])
\ No newline at end of file
+    args = parse_args(sys.argv[1:])
+    index_params = {}
+    if args.index == "ivf":
+        index_params = {"nlist": args.nlist, "nprobe": args.nprobe}
+    dataset = args.paths[0] if len(args.paths) == 2 else DATASET
+    workers = args.workers or os.cpu_count() or 1
+    summary = encode_db(args.paths[-1], dataset=dataset, full=args.full,
+                        index=args.index, index_params=index_params, workers=workers)
+    sys.exit(0 if summary else 1)
@@ -0,0 +1,201 @@
+"""Content-addressed cache of face encodings.
+
+The key is a hash of the decoded pixels around the face box plus the
+encoder settings, so identical faces (a re-submitted kiosk frame, a
+dataset image re-encoded by encode_db.py --full, the same photo uploaded
+twice) skip the ResNet forward pass. Two tiers: a bounded in-memory LRU,
+and optionally one .npy file per key on disk, trimmed by total size.
+
+The disk tier is opt-in per call (`persist=True`, which encode_db.py
+passes): live recognition, the recognition workers and the register
+quality checks stay in memory and never touch the disk.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+import models
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# FRAS_ENCODING_CACHE=<dir> moves the disk tier; set it empty to turn it off
+CACHE_DIR = os.environ.get("FRAS_ENCODING_CACHE", str(ROOT / "cache" / "encodings")) or None
+
+# Bump when the encoder or the key layout changes
+KEY_VERSION = 1
+
+# dlib's face chip reaches beyond the detection box; hash this much
+# margin (fraction of the box size) around it as well
+MARGIN = 0.25
+
+
+def crop_key(image, box, num_jitters=1, model="small"):
+    """Cache key for encoding the face at `box` in `image` with these settings."""
+    h, w = image.shape[:2]
+    top, right, bottom, left = box
+    mh, mw = int((bottom - top) * MARGIN), int((right - left) * MARGIN)
+    y0, y1 = max(0, top - mh), min(h, bottom + mh)
+    x0, x1 = max(0, left - mw), min(w, right + mw)
+    crop = np.ascontiguousarray(image[y0:y1, x0:x1])
+    digest = hashlib.sha1()
+    digest.update(f"{KEY_VERSION}|{model}|{num_jitters}|{top - y0},{right - x0},"
+                  f"{bottom - y0},{left - x0}|{crop.shape}|{crop.dtype}".encode())
+    digest.update(crop.data)
+    return digest.hexdigest()
+
+
+class EncodingCache:
+    """LRU of encodings in memory, optionally backed by files in `disk_dir`."""
+
+    def __init__(self, max_items=4096, disk_dir=None, disk_bytes=64 << 20):
+        self.max_items = max_items
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_bytes = disk_bytes
+        self.hits = self.disk_hits = self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_size = None
+
+    def _path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.npy"
+
+    def get(self, key, disk=False):
+        """Cached encoding or None; `disk` also looks in the disk tier."""
+        with self._lock:
+            encoding = self._items.get(key)
+            if encoding is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                metrics.count("encoding_cache", result="hit")
+                return encoding
+        encoding = self._read_disk(key) if disk else None
+        with self._lock:
+            if encoding is None:
+                self.misses += 1
+                metrics.count("encoding_cache", result="miss")
+                return None
+            self.disk_hits += 1
+            metrics.count("encoding_cache", result="disk_hit")
+            self._remember(key, encoding)
+        return encoding
+
+    def put(self, key, encoding, persist=False):
+        """Store an encoding; `persist` also writes it to the disk tier."""
+        encoding = np.array(encoding)
+        encoding.flags.writeable = False
+        with self._lock:
+            self._remember(key, encoding)
+        if persist and self.disk_dir is not None:
+            self._write_disk(key, encoding)
+
+    def _remember(self, key, encoding):
+        self._items[key] = encoding
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def _read_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            encoding = np.load(path, allow_pickle=False)
+            # Touch it so size-based eviction drops the least recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return encoding
+
+    def _write_disk(self, key, encoding):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, encoding, allow_pickle=False)
+            os.replace(tmp, path)
+            size = path.stat().st_size
+        except OSError as e:
+            print(f"[WARN] Could not write encoding cache entry {path}: {e}")
+            return
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan_size()
+            else:
+                self._disk_size += size
+            over = self._disk_size > self.disk_bytes
+        if over:
+            self.trim()
+
+    def _scan_size(self):
+        return sum(p.stat().st_size for p in self.disk_dir.glob("*/*.npy"))
+
+    def trim(self):
+        """Delete least recently used disk entries until under 90% of disk_bytes."""
+        files = []
+        for p in self.disk_dir.glob("*/*.npy"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        target = int(self.disk_bytes * 0.9)
+        removed = 0
+        for _, size, p in files:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._disk_size = total
+        metrics.count("encoding_cache_evictions", removed)
+        return removed
+
+    def encode(self, image, boxes, num_jitters=1, model="small", persist=False):
+        """face_recognition.face_encodings(), computing only the uncached faces.
+
+        `persist` reads and writes the disk tier as well as memory.
+        """
+        keys = [crop_key(image, box, num_jitters, model) for box in boxes]
+        encodings = [self.get(key, persist) for key in keys]
+        missing = [i for i, e in enumerate(encodings) if e is None]
+        if missing:
+            fresh = models.face_encodings(
+                image, [boxes[i] for i in missing], num_jitters=num_jitters, model=model)
+            for i, encoding in zip(missing, fresh):
+                self.put(keys[i], encoding, persist)
+                encodings[i] = encoding
+        return encodings
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._items), "hits": self.hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    """The process-wide cache used by the recognize and encode paths."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = EncodingCache(disk_dir=CACHE_DIR)
+        return _shared
+
+
+def encode(image, boxes, num_jitters=1, persist=False):
+    return shared().encode(image, boxes, num_jitters=num_jitters, persist=persist)
@@ -0,0 +1,301 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import metrics
+import models
+
+# ROOT PATH
+ROOT = Path(__file__).resolve().parent.parent
+DATASET = ROOT / "dataset"
+
+# Default register_bulk() processes; each one loads its own dlib models
+ENCODE_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class RecognitionEngine:
+    """Resident recognizer: models and encodings stay loaded between requests.
+
+    `matcher` is an immutable snapshot of one gallery generation. Requests
+    take the current reference and keep using it; refresh() swaps in a new
+    generation once encode_db has renamed it into place, so recognition
+    never waits for a rebuild or sees a partial one.
+    """
+
+    def __init__(self, encodings_path, dataset=DATASET, threshold=0.35, encode_workers=None):
+        self.encodings_path = Path(encodings_path).resolve()
+        self.dataset = Path(dataset).resolve()
+        self.threshold = threshold
+        self.encode_workers = encode_workers or ENCODE_WORKERS
+        self.matcher = None
+        self.two_stage = False
+        self.nprobe = None
+        self.startup_time = None
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._finish_lock = threading.Lock()
+        self._writes = queue.Queue()
+        self._writer = None
+        self._encoder = None
+        self._encoder_lock = threading.Lock()
+
+    def start(self):
+        """Import face_recognition (loads the dlib models) and the gallery once."""
+        t0 = time.perf_counter()
+        models.warm_up()
+
+        if self.encodings_path.exists():
+            self.refresh()
+        self.startup_time = time.perf_counter() - t0
+        print(f"[ENGINE] Ready in {self.startup_time:.2f}s "
+              f"({len(self.matcher.gallery) if self.matcher else 0} encodings)")
+        return self
+
+    def _file_stamp(self):
+        # Gallery and its index are written separately, watch both
+        from face_index import index_path_for
+
+        stamp = []
+        for path in (self.encodings_path, index_path_for(self.encodings_path)):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                if path == self.encodings_path:
+                    return None
+                st = None
+            stamp.append((st.st_mtime_ns, st.st_size) if st else None)
+        return tuple(stamp)
+
+    @property
+    def generation(self):
+        return self.matcher.gallery.generation if self.matcher is not None else None
+
+    def refresh(self):
+        """Reload the gallery only if the encodings file (or its index) changed on disk."""
+        import recognize
+
+        with self._refresh_lock:
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp:
+                return False
+            with metrics.span("load_gallery"):
+                self.matcher = recognize.load_matcher(self.encodings_path, self.two_stage, self.nprobe)
+            self._stamp = stamp
+        print(f"[ENGINE] Loaded {len(self.matcher.gallery)} face encodings "
+              f"(generation {self.generation}, {self.matcher.kind} index)")
+        return True
+
+    def rebuild(self, full=False, progress=None):
+        """Incrementally re-encode the dataset in-process, then refresh."""
+        import encode_db
+
+        # Uploaded images must be on disk before the dataset is rescanned;
+        # join under the lock so none can be queued in between
+        with self._lock, metrics.span("encode_db"):
+            self._writes.join()
+            summary = encode_db.encode_db(self.encodings_path, dataset=self.dataset, full=full,
+                                          progress=progress)
+            self.refresh()
+        return summary
+
+    def register_bulk(self, items, workers=None):
+        """Encode uploaded images in memory and append them to the gallery.
+
+        `items` yields (student id, image bytes, face box or None) and may be
+        a generator over a request still being read. Only the new encodings
+        are added; the images are written to dataset/<id>/ on a background
+        thread while encoding continues.
+        """
+        import encode_db
+
+        workers = workers or self.encode_workers
+        pending = {}
+        summary = {"images": 0, "encoded": 0, "duplicates": 0, "rejected": [], "students": {}}
+
+        def keyed():
+            for sid, data, box in items:
+                summary["images"] += 1
+                # Saved as .jpg, so a PNG upload is stored (and encoded) as JPEG
+                data = encode_db.as_jpeg(data)
+                # Content-addressed names: re-uploading the same image is a no-op
+                key = f"{sid}/{sid}_{hashlib.sha1(data).hexdigest()[:16]}.jpg"
+                if key in pending:
+                    summary["duplicates"] += 1
+                    continue
+                pending[key] = (sid, data, box)
+                yield key, data, box
+
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_images, daemon=True)
+            self._writer.start()
+
+        # Encode outside the engine lock, in the long-lived spawn pool
+        with self._encoder_lock:
+            if self._encoder is None and workers > 1:
+                self._encoder = encode_db.spawn_pool(workers)
+            pool = self._encoder
+        results = []
+        try:
+            for key, digest, encoding, _ in encode_db.encode_blobs(keyed(), workers, pool):
+                sid, data, box = pending[key]
+                pending[key] = None
+                if encoding is None:
+                    summary["rejected"].append(key)
+                    continue
+                results.append((key, sid, digest, len(data), encoding))
+                summary["students"][sid] = summary["students"].get(sid, 0) + 1
+                self._writes.put(("image", key, data, box))
+        except (TimeoutError, BrokenProcessPool) as e:
+            # A hung or dead worker: start a fresh pool next time
+            with self._encoder_lock:
+                if pool is not None and self._encoder is pool:
+                    encode_db.discard_pool(pool)
+                    self._encoder = None
+            raise RuntimeError(f"Bulk encoding failed: {e or 'a worker process died'}")
+
+        with self._lock:
+            summary["encoded"] = encode_db.append_encodings(self.encodings_path, results)
+            self._writes.put(("record", [r[0] for r in results]))
+            self.refresh()
+        return summary
+
+    def _write_images(self):
+        # Background writer for register_bulk(): images first, then their stamps
+        import encode_db
+
+        while True:
+            kind, *args = self._writes.get()
+            try:
+                if kind == "image":
+                    key, data, box = args
+                    path = self.dataset / key
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    if box is not None:
+                        encode_db.write_sidecar(path, box)
+                    tmp = path.with_suffix(".part")
+                    with open(tmp, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp, path)
+                else:
+                    # gallery_lock inside serialises this with encode_db runs
+                    encode_db.record_files(self.encodings_path, self.dataset, args[0])
+            except OSError as e:
+                print(f"[ENGINE] Could not save uploaded image: {e}")
+            finally:
+                self._writes.task_done()
+
+    def match_image(self, rgb, threshold=None, policy=None):
+        """Detect and match every face in an RGB image; [(box, (id, distance))]."""
+        import recognize
+
+        matcher = self.matcher
+        if matcher is None or not matcher.gallery:
+            return []
+        threshold = self.threshold if threshold is None else threshold
+        return recognize.match_frame(rgb, matcher, threshold, policy)
+
+    def mark_attendance(self, entries, wait=True):
+        """Queue {"id", "distance"} entries with the attendance writer; a row per entry.
+
+        With `wait`, return once they are committed; requests arriving
+        meanwhile share the same batch.
+        """
+        import recognize
+        from attendance_writer import open_writer
+
+        if not entries:
+            return []
+        rows = recognize.mark_attendance_batch(entries)
+        if wait and not open_writer().flush():
+            raise RuntimeError("Attendance could not be saved")
+        return rows
+
+    def recognize(self, threshold=None, timeout=60):
+        """Run the camera loop (headless) and mark attendance for the first match.
+
+        Raises TimeoutError if nobody is recognised within `timeout` seconds.
+        """
+        import recognize
+
+        self.refresh()
+        matcher = self.matcher
+        if matcher is None or not matcher.gallery:
+            return None
+        threshold = self.threshold if threshold is None else threshold
+        recognized_id, best_dist = recognize.capture_match(matcher, threshold, headless=True,
+                                                           timeout=timeout)
+        if recognized_id is None:
+            return None
+        return self.mark_attendance([{"id": recognized_id, "distance": best_dist}])[0]
+
+    def start_session(self, threshold=None, duration=None, min_hits=3, window=3.0, source=0):
+        """Start recognising every face on a background thread (headless)."""
+        from session import AttendanceSession, run_session
+
+        with self._session_lock:
+            # A session that ran out (duration, end of the source) is replaced
+            if self._session is not None and self._session[2].is_alive():
+                raise RuntimeError("An attendance session is already running")
+            self.refresh()
+            if self.matcher is None or not self.matcher.gallery:
+                raise RuntimeError("No encoded faces - register students first")
+
+            session = AttendanceSession(window=window, min_hits=min_hits)
+            stop = threading.Event()
+            threshold = self.threshold if threshold is None else threshold
+
+            def run():
+                try:
+                    run_session(self.matcher, session, threshold, stop_event=stop,
+                                duration=duration, source=source, headless=True)
+                except IOError:
+                    session.error = "Camera not detected"
+                # Write the confirmed students even if nobody calls stop
+                try:
+                    self._finish_session(session)
+                except Exception as e:
+                    session.error = str(e)
+
+            thread = threading.Thread(target=run, daemon=True)
+            self._session = (session, stop, thread)
+            thread.start()
+            return session
+
+    def session_status(self):
+        with self._session_lock:
+            if self._session is None:
+                return None
+            session, _, thread = self._session
+        return {
+            "running": thread.is_alive(),
+            "started": session.started,
+            "frames": session.frames,
+            "error": session.error,
+            "present": session.confirmed(),
+            "marked": session.marked,
+        }
+
+    def stop_session(self):
+        """Stop the running session and write all confirmed students in one batch."""
+        with self._session_lock:
+            if self._session is None:
+                return None, []
+            session, stop, thread = self._session
+            self._session = None
+        stop.set()
+        thread.join(timeout=10)
+        return session, self._finish_session(session)
+
+    def _finish_session(self, session):
+        """Mark a session's confirmed students, once, whichever of its thread or stop gets here first."""
+        with self._finish_lock:
+            if session.marked is None:
+                session.marked = self.mark_attendance(session.stop())
+            return session.marked
@@ -0,0 +1,182 @@
+from pathlib import Path
+
+import numpy as np
+
+from gallery import DIM, atomic_file
+
+INDEX_VERSION = 2
+
+# Galleries at least this big get the approximate backend with kind="auto"
+AUTO_IVF_ROWS = 50000
+
+
+def index_path_for(encodings_path):
+    # Index lives next to the encodings file
+    return Path(str(encodings_path) + ".index")
+
+
+def gallery_stamp(gallery):
+    # Cheap fingerprint so an index is never used with the wrong gallery
+    return (len(gallery), round(float(gallery.encodings.sum(dtype=np.float64)), 3))
+
+
+class ExactIndex:
+    """Brute-force scan of every gallery row (optionally centroid two-stage)."""
+
+    kind = "exact"
+
+    def __init__(self, gallery, two_stage=False, candidates=1):
+        self.gallery = gallery
+        self.two_stage = two_stage
+        self.candidates = candidates
+
+    @classmethod
+    def build(cls, gallery, **params):
+        return cls(gallery, **params)
+
+    def state(self):
+        return {"two_stage": self.two_stage, "candidates": self.candidates}
+
+    @classmethod
+    def from_state(cls, gallery, state):
+        return cls(gallery, **state)
+
+    def extend(self, gallery):
+        """Same index over `gallery`, which has extra rows appended."""
+        return type(self)(gallery, **self.state())
+
+    def search(self, probes):
+        return self.gallery.nearest(probes, two_stage=self.two_stage, candidates=self.candidates)
+
+    def match(self, probes, threshold):
+        rows, dists = self.search(probes)
+        labels, index = self.gallery.labels, self.gallery.index
+        return [(labels[index[r]] if d < threshold else None, float(d))
+                for r, d in zip(rows, dists)]
+
+
+class IVFIndex(ExactIndex):
+    """Inverted-file index: k-means partitions, only `nprobe` lists are scanned.
+
+    Recall is tuned with `nprobe`; nprobe == nlist degenerates to exact search.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, gallery, centres, order, bounds, nprobe=8):
+        self.gallery = gallery
+        self.centres = np.asarray(centres, dtype=np.float32)
+        self.centre_norms = np.einsum("ij,ij->i", self.centres, self.centres)
+        self.order = np.asarray(order, dtype=np.int64)
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, gallery, nlist=None, nprobe=8, iterations=10, sample=100000, seed=0):
+        x = gallery.encodings
+        n = len(x)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        # Train k-means on a sample, then assign every row
+        rng = np.random.default_rng(seed)
+        train = x[rng.choice(n, min(n, max(sample, nlist)), replace=False)]
+        centres = train[rng.choice(len(train), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = cls._assign(train, centres)
+            sums = np.zeros_like(centres)
+            np.add.at(sums, assign, train)
+            counts = np.bincount(assign, minlength=nlist)
+            filled = counts > 0
+            centres[filled] = sums[filled] / counts[filled, None]
+
+        assign = cls._assign(x, centres)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        return cls(gallery, centres, order, bounds, nprobe=nprobe)
+
+    @staticmethod
+    def _assign(x, centres, chunk=65536):
+        cn = np.einsum("ij,ij->i", centres, centres)
+        out = np.empty(len(x), dtype=np.int64)
+        for s in range(0, len(x), chunk):
+            block = x[s:s + chunk]
+            out[s:s + chunk] = (cn[None, :] - 2.0 * (block @ centres.T)).argmin(axis=1)
+        return out
+
+    def state(self):
+        return {"centres": self.centres, "order": self.order,
+                "bounds": self.bounds, "nprobe": self.nprobe}
+
+    @classmethod
+    def from_state(cls, gallery, state):
+        return cls(gallery, **state)
+
+    def extend(self, gallery):
+        # Appended rows join their nearest existing list; centres are not retrained
+        assign = np.repeat(np.arange(len(self.centres)), np.diff(self.bounds))
+        old = np.empty(len(self.order), dtype=np.int64)
+        old[self.order] = assign
+        new = self._assign(gallery.encodings[len(self.order):], self.centres)
+        assign = np.concatenate([old, new])
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self.centres) + 1))
+        return type(self)(gallery, self.centres, order, bounds, nprobe=self.nprobe)
+
+    def search(self, probes):
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, DIM)
+        rows = np.zeros(len(probes), dtype=np.int64)
+        dists = np.full(len(probes), np.inf, dtype=np.float32)
+        if len(probes) == 0 or len(self.gallery) == 0:
+            return rows, dists
+
+        nprobe = min(self.nprobe, len(self.centres))
+        cd = self.centre_norms[None, :] - 2.0 * (probes @ self.centres.T)
+        lists = np.argpartition(cd, nprobe - 1, axis=1)[:, :nprobe]
+        for i, probe_lists in enumerate(lists):
+            cand = np.concatenate([self.order[self.bounds[c]:self.bounds[c + 1]]
+                                   for c in probe_lists])
+            if len(cand) == 0:
+                continue
+            d = self.gallery.distances(probes[i], cand)[0]
+            j = d.argmin()
+            rows[i], dists[i] = cand[j], d[j]
+        return rows, dists
+
+
+BACKENDS = {cls.kind: cls for cls in (ExactIndex, IVFIndex)}
+
+
+def build_index(gallery, kind="auto", **params):
+    if kind == "auto":
+        kind = "ivf" if len(gallery) >= AUTO_IVF_ROWS else "exact"
+    if kind not in BACKENDS:
+        raise ValueError(f"unknown index backend: {kind}")
+    return BACKENDS[kind].build(gallery, **params)
+
+
+def save_index(index, gallery, path):
+    # Plain .npz arrays (no pickle), written atomically
+    count, checksum = gallery_stamp(gallery)
+    arrays = {"state_" + k: np.asarray(v) for k, v in index.state().items()}
+    with atomic_file(path) as f:
+        np.savez(f, version=INDEX_VERSION, kind=index.kind,
+                 stamp_count=count, stamp_sum=checksum, **arrays)
+
+
+def load_index(path, gallery):
+    """Index stored next to the gallery, or an exact scan if missing/stale."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            data = dict(data)
+        stamp = (int(data["stamp_count"]), float(data["stamp_sum"]))
+        version = int(data["version"])
+    except (OSError, ValueError, KeyError):
+        return ExactIndex(gallery)
+    if version != INDEX_VERSION or stamp != gallery_stamp(gallery):
+        print(f"[WARN] Index {path} does not match the gallery - using exact search")
+        return ExactIndex(gallery)
+    state = {k[len("state_"):]: (v.item() if v.ndim == 0 else v)
+             for k, v in data.items() if k.startswith("state_")}
+    return BACKENDS[str(data["kind"])].from_state(gallery, state)
@@ -0,0 +1,324 @@
+import json
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+GALLERY_VERSION = 4
+DIM = 128
+
+# Windows cannot replace a file that is memory-mapped, so readers there
+# load a private copy; elsewhere the old mapping survives the rename
+MMAP_DEFAULT = os.name != "nt"
+
+# Binary gallery layout (little endian):
+#   header   HEADER_SIZE bytes, see HEADER below
+#   block    float32 encodings, count x dim
+#   block    int32 label index, count
+#   block    float32 squared norms, count
+#   block    interned id table: nlabels x (uint32 length, utf-8 bytes)
+#   block    per-row provenance as a utf-8 JSON list
+# Every block starts on an ALIGN-byte boundary so it can be memory-mapped.
+# Version 4 adds a generation counter (version 3 headers read it as 0).
+MAGIC = b"FRASGAL\0"
+HEADER = struct.Struct("<8sIIQQQQQQQQQQ")
+HEADER_SIZE = 128
+ALIGN = 64
+
+
+@contextmanager
+def atomic_file(path):
+    # Write to a temp file in the same folder, then rename over the target
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _replace(src, dst, attempts=50):
+    # On Windows a reader holding the target open makes the rename fail briefly
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if os.name != "nt" or attempt == attempts - 1:
+                raise
+            time.sleep(0.02)
+
+
+@contextmanager
+def gallery_lock(path):
+    """Exclusive cross-process lock (<path>.lock) held while rebuilding a gallery."""
+    with open(str(path) + ".lock", "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # LK_LOCK gives up after ~10 s; keep waiting
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def read_generation(path):
+    """Generation number stored in a gallery header (0 if missing or legacy)."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(HEADER.size)
+    except OSError:
+        return 0
+    if len(head) < HEADER.size or head[:len(MAGIC)] != MAGIC:
+        return 0
+    return HEADER.unpack(head)[-1]
+
+
+def _pad(f):
+    f.write(b"\0" * (-f.tell() % ALIGN))
+    return f.tell()
+
+
+class Gallery:
+    """Known faces as one contiguous float32 N x 128 matrix.
+
+    `index[i]` is the position in `labels` (student ids) of row i, `norms`
+    holds the squared row norms so distances reduce to one matrix product.
+    """
+
+    def __init__(self, encodings, index, labels, norms=None, provenance=None, generation=0):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, DIM)
+        self.index = np.asarray(index, dtype=np.int32)
+        self.labels = list(labels)
+        if norms is None:
+            norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+        self.norms = np.asarray(norms, dtype=np.float32)
+        self.provenance = provenance
+        self.generation = generation
+        self._centroids = None
+
+    @classmethod
+    def from_lists(cls, encodings, ids, provenance=None):
+        labels = sorted(set(ids))
+        lookup = {sid: i for i, sid in enumerate(labels)}
+        matrix = np.array(encodings, dtype=np.float32).reshape(-1, DIM)
+        return cls(matrix, [lookup[sid] for sid in ids], labels, provenance=provenance)
+
+    def append(self, encodings, ids, provenance=None):
+        """New Gallery with extra rows after the existing ones (labels stay sorted)."""
+        encodings = np.array(encodings, dtype=np.float32).reshape(-1, DIM)
+        old_ids = [self.labels[i] for i in self.index]
+        if self.provenance is not None and provenance is not None:
+            provenance = list(self.provenance) + list(provenance)
+        else:
+            provenance = None
+        labels = sorted(set(old_ids) | set(ids))
+        lookup = {sid: i for i, sid in enumerate(labels)}
+        matrix = np.concatenate([np.asarray(self.encodings), encodings])
+        norms = np.concatenate([np.asarray(self.norms),
+                                np.einsum("ij,ij->i", encodings, encodings)])
+        return Gallery(matrix, [lookup[sid] for sid in old_ids + list(ids)], labels,
+                       norms, provenance)
+
+    @classmethod
+    def load(cls, path, mmap=None):
+        """Load a binary gallery.
+
+        Legacy pickle files are refused (unpickling runs arbitrary code);
+        migrate them once with `gallery.py convert`. The result is a
+        read-only snapshot; memory-mapped where the platform allows renaming
+        a newer generation over a mapped file.
+        """
+        mmap = MMAP_DEFAULT if mmap is None else mmap
+        with open(path, "rb") as f:
+            head = f.read(HEADER_SIZE)
+            if head[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a binary gallery (legacy pickle?) - "
+                                 f"convert it with: gallery.py convert <pkl> <bin>")
+
+            (_, version, dim, count, nlabels, enc_off, idx_off, norm_off,
+             labels_off, labels_len, prov_off, prov_len, generation) = HEADER.unpack(head[:HEADER.size])
+            if version not in (3, GALLERY_VERSION) or dim != DIM:
+                raise ValueError(f"unsupported gallery version {version} (dim {dim})")
+
+            f.seek(labels_off)
+            table = f.read(labels_len)
+            f.seek(prov_off)
+            provenance = json.loads(f.read(prov_len).decode("utf-8")) if prov_len else None
+
+            # Map/read through the handle that held the header: reopening by
+            # path could pick up a newer generation renamed in meanwhile
+            if count == 0:
+                encodings, index, norms = np.zeros((0, DIM), np.float32), [], None
+            elif mmap:
+                # Near zero-copy: pages are read on first touch, shared between readers
+                encodings = np.memmap(f, np.float32, "r", offset=enc_off, shape=(count, dim))
+                index = np.memmap(f, np.int32, "r", offset=idx_off, shape=(count,))
+                norms = np.memmap(f, np.float32, "r", offset=norm_off, shape=(count,))
+            else:
+                f.seek(enc_off)
+                encodings = np.fromfile(f, np.float32, count * dim).reshape(count, dim)
+                f.seek(idx_off)
+                index = np.fromfile(f, np.int32, count)
+                f.seek(norm_off)
+                norms = np.fromfile(f, np.float32, count)
+                for a in (encodings, index, norms):
+                    a.flags.writeable = False
+
+        labels = []
+        pos = 0
+        for _ in range(nlabels):
+            (n,) = struct.unpack_from("<I", table, pos)
+            labels.append(table[pos + 4:pos + 4 + n].decode("utf-8"))
+            pos += 4 + n
+
+        return cls(encodings, index, labels, norms, provenance, generation)
+
+    @classmethod
+    def _load_pickle(cls, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") == 2:
+            return cls(data["encodings"], data["index"], data["labels"], data["norms"])
+        # Pre-matrix format: list of arrays plus list of ids
+        return cls.from_lists(data["encodings"], data["ids"])
+
+    def save(self, path, generation=None):
+        """Write the binary gallery atomically (temp file + rename).
+
+        Each save is a new generation: one more than the file it replaces,
+        unless given. Callers that may race hold gallery_lock(path).
+        """
+        if generation is None:
+            generation = read_generation(path) + 1
+        self.generation = generation
+        table = b"".join(struct.pack("<I", len(b)) + b
+                         for b in (label.encode("utf-8") for label in self.labels))
+        prov = json.dumps(self.provenance).encode("utf-8") if self.provenance is not None else b""
+
+        with atomic_file(path) as f:
+            f.write(b"\0" * HEADER_SIZE)
+            enc_off = _pad(f)
+            f.write(np.ascontiguousarray(self.encodings, dtype="<f4").tobytes())
+            idx_off = _pad(f)
+            f.write(np.ascontiguousarray(self.index, dtype="<i4").tobytes())
+            norm_off = _pad(f)
+            f.write(np.ascontiguousarray(self.norms, dtype="<f4").tobytes())
+            labels_off = _pad(f)
+            f.write(table)
+            prov_off = _pad(f)
+            f.write(prov)
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, GALLERY_VERSION, DIM, len(self), len(self.labels),
+                                enc_off, idx_off, norm_off, labels_off, len(table),
+                                prov_off, len(prov), generation))
+            f.seek(0, os.SEEK_END)
+
+    def __len__(self):
+        return len(self.encodings)
+
+    @property
+    def ids(self):
+        return [self.labels[i] for i in self.index]
+
+    def centroids(self):
+        """Per-student mean encoding plus the rows belonging to each student."""
+        if self._centroids is None:
+            order = np.argsort(self.index, kind="stable")
+            bounds = np.searchsorted(self.index[order], np.arange(len(self.labels) + 1))
+            sums = np.zeros((len(self.labels), DIM), dtype=np.float32)
+            np.add.at(sums, self.index, self.encodings)
+            counts = np.diff(bounds).astype(np.float32)
+            means = sums / np.maximum(counts, 1)[:, None]
+            mean_norms = np.einsum("ij,ij->i", means, means)
+            self._centroids = (means, mean_norms, order, bounds)
+        return self._centroids
+
+    def distances(self, probes, rows=None):
+        # ||p - g||^2 = ||p||^2 + ||g||^2 - 2 p.g, for all probes at once
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, DIM)
+        g = self.encodings if rows is None else self.encodings[rows]
+        gn = self.norms if rows is None else self.norms[rows]
+        pn = np.einsum("ij,ij->i", probes, probes)
+        d2 = pn[:, None] + gn[None, :] - 2.0 * (probes @ g.T)
+        return np.sqrt(np.maximum(d2, 0.0))
+
+    def nearest(self, probes, two_stage=False, candidates=1):
+        """Row and distance of the closest gallery sample for each probe."""
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, DIM)
+        if len(probes) == 0 or len(self) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if not two_stage:
+            d = self.distances(probes)
+            rows = d.argmin(axis=1)
+            return rows, d[np.arange(len(probes)), rows]
+
+        # Stage 1: closest student centroids, stage 2: that student's samples
+        means, mean_norms, order, bounds = self.centroids()
+        k = min(candidates, len(self.labels))
+        pn = np.einsum("ij,ij->i", probes, probes)
+        cd = pn[:, None] + mean_norms[None, :] - 2.0 * (probes @ means.T)
+        if k < len(self.labels):
+            top = np.argpartition(cd, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(k), (len(probes), 1))
+
+        rows = np.empty(len(probes), dtype=np.int64)
+        dists = np.empty(len(probes), dtype=np.float32)
+        for i, students in enumerate(top):
+            cand = np.concatenate([order[bounds[s]:bounds[s + 1]] for s in students])
+            d = self.distances(probes[i], cand)[0]
+            j = d.argmin()
+            rows[i], dists[i] = cand[j], d[j]
+        return rows, dists
+
+    def match(self, probes, threshold, two_stage=False, candidates=1):
+        """(student id or None, distance) for each probe encoding."""
+        rows, dists = self.nearest(probes, two_stage=two_stage, candidates=candidates)
+        return [
+            (self.labels[self.index[r]] if d < threshold else None, float(d))
+            for r, d in zip(rows, dists)
+        ]
+
+
+def convert(src, dst):
+    """Rewrite a pickled encodings file in the binary gallery format."""
+    gallery = Gallery._load_pickle(src)
+    gallery.save(dst)
+    print(f"[OK] Converted {src} -> {dst} "
+          f"({len(gallery)} encodings, {len(gallery.labels)} students)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "convert":
+        print("[ERROR] Usage: gallery.py convert <encodings.pkl> <encodings.bin>")
+        sys.exit(1)
+    convert(sys.argv[2], sys.argv[3])
@@ -0,0 +1,189 @@
+"""Background jobs for the web server, persisted in fras.db.
+
+Requests enqueue a job and return its id; a small pool of worker threads
+runs the jobs and records status/progress so clients can poll for them.
+"""
+import json
+import threading
+import time
+import traceback
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind        TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    progress    REAL NOT NULL DEFAULT 0,
+    message     TEXT,
+    result      TEXT,
+    error       TEXT,
+    created     REAL NOT NULL,
+    started     REAL,
+    finished    REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+"""
+
+COLUMNS = ("id", "kind", "params", "status", "progress", "message", "result", "error",
+           "created", "started", "finished")
+
+
+class Job:
+    """What a handler sees: its parameters and a way to report progress."""
+
+    def __init__(self, queue, job_id, params):
+        self.queue = queue
+        self.id = job_id
+        self.params = params
+
+    def progress(self, fraction, message=None):
+        with self.queue.storage.connect() as conn:
+            conn.execute("UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE id = ?",
+                         (min(max(float(fraction), 0.0), 1.0), message, self.id))
+
+
+class JobQueue:
+    """Persisted FIFO of jobs run by `workers` threads.
+
+    At most one job of each kind runs at a time (two encodes or two camera
+    captures would only fight over the same resource), different kinds run
+    side by side. Jobs left running by a previous process are requeued on
+    start(), except kinds registered with replay=False: those are failed,
+    along with any still queued, rather than run unattended.
+    """
+
+    def __init__(self, storage, workers=2):
+        self.storage = storage
+        self.workers = workers
+        self.handlers = {}
+        self._no_replay = set()
+        self._running = set()
+        self._cond = threading.Condition()
+        self._started = False
+        with storage.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def register(self, kind, handler, replay=True):
+        """`handler(job)` runs a job of this kind; its return value is stored as JSON.
+
+        replay=False: do not run jobs of this kind left over from a previous process.
+        """
+        self.handlers[kind] = handler
+        if not replay:
+            self._no_replay.add(kind)
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return self
+            self._started = True
+        kinds = sorted(self._no_replay)
+        with self.storage.connect() as conn:
+            dropped = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'interrupted by a server restart', "
+                f"finished = ? WHERE status IN ('queued', 'running') "
+                f"AND kind IN ({', '.join('?' * len(kinds))})", [time.time()] + kinds).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL, progress = 0, "
+                "message = 'requeued after restart' WHERE status = 'running'").rowcount
+        if dropped:
+            print(f"[JOBS] Failed {dropped} job(s) that must not run unattended after a restart")
+        if requeued:
+            print(f"[JOBS] Requeued {requeued} interrupted job(s)")
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        return self
+
+    def submit(self, kind, params=None, coalesce=False):
+        """Queue a job; with coalesce=True an already queued job of the same kind is reused."""
+        if kind not in self.handlers:
+            raise ValueError(f"unknown job kind: {kind}")
+        conn = self.storage.connect()
+        with conn:
+            # IMMEDIATE takes the write lock first, so two submits cannot both miss
+            conn.execute("BEGIN IMMEDIATE")
+            row = None
+            if coalesce:
+                row = conn.execute("SELECT id FROM jobs WHERE kind = ? AND status = 'queued' "
+                                   "ORDER BY id LIMIT 1", (kind,)).fetchone()
+            if row is None:
+                job_id = conn.execute(
+                    "INSERT INTO jobs (kind, params, status, created) VALUES (?, ?, 'queued', ?)",
+                    (kind, json.dumps(params or {}), time.time())).lastrowid
+            else:
+                job_id = row[0]
+        with self._cond:
+            self._cond.notify_all()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = self.storage.connect().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._as_dict(row) if row else None
+
+    def list(self, status=None, limit=50):
+        sql = f"SELECT {', '.join(COLUMNS)} FROM jobs"
+        params = []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        rows = self.storage.connect().execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit])
+        return [self._as_dict(r) for r in rows]
+
+    def count(self, status):
+        return self.storage.connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    @staticmethod
+    def _as_dict(row):
+        job = dict(zip(COLUMNS, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _claim(self):
+        # Oldest queued job whose kind is not already running here
+        conn = self.storage.connect()
+        with self._cond, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            busy = sorted(self._running)
+            row = conn.execute(
+                "SELECT id, kind, params FROM jobs WHERE status = 'queued' "
+                f"AND kind NOT IN ({', '.join('?' * len(busy))}) ORDER BY id LIMIT 1", busy
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?",
+                         (time.time(), row[0]))
+            self._running.add(row[1])
+        return row[0], row[1], json.loads(row[2])
+
+    def _finish(self, job_id, kind, status, result=None, error=None):
+        with self.storage.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, "
+                "progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error,
+                 time.time(), status, job_id))
+        with self._cond:
+            self._running.discard(kind)
+            self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                with self._cond:
+                    self._cond.wait(timeout=1.0)
+                continue
+            job_id, kind, params = claimed
+            try:
+                handler = self.handlers.get(kind)
+                if handler is None:
+                    raise ValueError(f"no handler for job kind {kind!r}")
+                result = handler(Job(self, job_id, params))
+                self._finish(job_id, kind, "done", result)
+            except Exception as e:
+                traceback.print_exc()
+                self._finish(job_id, kind, "failed", error=str(e))
@@ -1,30 +1,23 @@
 #include <iostream>
-#include <fstream>
 #include <string>
-#include <sstream>
-#include <vector>
+#include <cstdio>
 #include <cstdlib>
 using namespace std;
 
-struct Student { string id; string name; };
-
-vector<Student> load_students(const string &path) {
-    vector<Student> list;
-    ifstream in(path);
-    if(!in.is_open()) return list;
-    string line;
-    while(getline(in,line)) {
-        // Skip empty lines
-        if(line.empty() || line == "\r" || line == "\n") continue;
-        if(line.size()<2) continue;
-        
-        stringstream ss(line);
-        string id,name;
-        getline(ss,id,',');
-        getline(ss,name,',');
-        if(!id.empty()) list.push_back({id,name});
-    }
-    return list;
+#ifdef _WIN32
+#define popen _popen
+#define pclose _pclose
+#endif
+
+// Value of a string field in a recognize.py RESULT line ("" if missing)
+string json_field(const string &content, const string &key) {
+    size_t p = content.find("\"" + key + "\"");
+    if(p == string::npos) return "";
+    size_t colon = content.find(":", p);
+    size_t q = content.find("\"", colon);
+    if(colon == string::npos || q == string::npos) return "";
+    size_t end = content.find("\"", q+1);
+    return content.substr(q+1, end-q-1);
 }
 
 int main(){
@@ -32,14 +25,8 @@ int main(){
 
     string dataset = "..\\dataset";
     string pyfolder = "..\\python\\";
-    string enc_file = pyfolder + "encodings.pkl";
-    string students_file = "..\\students.csv";
-    string attendance_file = "..\\attendance.csv";
-    string result_file = "..\\result.json";
-
-    // Create files if they don't exist
-    { ofstream f(students_file, ios::app); }
-    { ofstream f(attendance_file, ios::app); }
+    string enc_file = pyfolder + "encodings.bin";
+    string storage_cmd = python + "\"" + pyfolder + "storage.py\" ";
 
     while(true){
         cout << "\n===== FRAS MENU =====\n";
@@ -83,59 +70,51 @@ int main(){
             cout << "[AUTO] Encoding latest dataset...\n";
             system(enc_cmd.c_str());
 
-            // Run recognition
-            string recog_cmd = python + "\"" + pyfolder + "recognize.py\" \"" 
+            // Run recognition unbuffered, echoing its output; the result
+            // comes back as one "RESULT {json}" line on stdout
+            string recog_cmd = python + "-u \"" + pyfolder + "recognize.py\" \"" 
                                + enc_file + "\" 0.35";
-            system(recog_cmd.c_str());
-
-            // Read result.json
-            ifstream r(result_file);
-            if(!r.is_open()) { 
-                cout << "[WARN] No recognition result.\n"; 
-                continue; 
+            FILE *pipe = popen(recog_cmd.c_str(), "r");
+            if(!pipe) {
+                cout << "[WARN] Could not run recognition.\n";
+                continue;
             }
 
-            string content,line;
-            while(getline(r,line)) content += line;
-            r.close();
+            string content;
+            char buf[4096];
+            while(fgets(buf, sizeof(buf), pipe)) {
+                string line = buf;
+                if(line.rfind("RESULT ", 0) == 0) content = line.substr(7);
+                else cout << line;
+            }
+            pclose(pipe);
 
-            // Parse ID from JSON
-            size_t p_id = content.find("\"id\"");
-            if(p_id == string::npos) {
-                cout << "[WARN] No valid ID in result.\n";
+            // Parse ID and name from JSON (recognize.py already stored the record)
+            string id = json_field(content, "id");
+            if(id.empty()) {
+                cout << "[WARN] No recognition result.\n";
                 continue;
             }
-            size_t q = content.find("\"", p_id+5);
-            size_t rpos = content.find("\"", q+1);
-            string id = content.substr(q+1, rpos-q-1);
-
-            // Find student name
-            vector<Student> list = load_students(students_file);
-            string name = "Unknown";
-            for(auto &s : list)
-                if(s.id == id) name = s.name;
-
-            // Mark attendance (C++ also writes for backup)
-            ofstream out(attendance_file, ios::app);
-            out << id << "," << name << "\n";
-            out.close();
-
-            cout << "[SUCCESS] Attendance marked for " << name << endl;
+            string name = json_field(content, "name");
+
+            if(content.find("\"duplicate\": true") != string::npos)
+                cout << "[INFO] Attendance already marked for " << name << endl;
+            else
+                cout << "[SUCCESS] Attendance marked for " << name << endl;
         }
 
         // SHOW STUDENTS
         else if(choice == 3){
-            auto list = load_students(students_file);
             cout << "\n--- Students List ---\n";
-            for(auto &s : list) cout<<s.id<<" | "<<s.name<<"\n";
+            string cmd = storage_cmd + "students";
+            system(cmd.c_str());
         }
 
         // SHOW ATTENDANCE
         else if(choice == 4){
-            ifstream in(attendance_file);
-            string line;
             cout << "\n--- Attendance Records ---\n";
-            while(getline(in,line)) cout<<line<<"\n";
+            string cmd = storage_cmd + "attendance";
+            system(cmd.c_str());
         }
 
         // EXIT
@@ -0,0 +1,76 @@
+"""One place that imports face_recognition, on first use.
+
+`import face_recognition` loads dlib and deserialises its model files,
+which takes seconds. Importing it at the top of every script made
+register.py and encode_db.py pay that even to print a usage error or
+update the student list. Call sites go through the wrappers below, so the
+models load the first time a face is actually detected or encoded.
+
+warm_up() loads them explicitly and runs one tiny encoding, because dlib
+also initialises lazily on the first call. preload() does that on a
+background thread while the caller opens the camera or scans the dataset.
+"""
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+_fr = None
+_lock = threading.Lock()
+_warm = False
+
+
+def get():
+    """The face_recognition module, imported on first call."""
+    global _fr
+    if _fr is None:
+        with _lock:
+            if _fr is None:
+                import face_recognition
+                _fr = face_recognition
+    return _fr
+
+
+def warm_up():
+    """Load the models and run one encoding; seconds taken (0 if already warm)."""
+    global _warm
+    if _warm:
+        return 0.0
+    t0 = time.perf_counter()
+    with metrics.span("load_models"):
+        fr = get()
+        with _lock:
+            if not _warm:
+                blank = np.zeros((64, 64, 3), dtype=np.uint8)
+                fr.face_encodings(blank, [(0, 64, 64, 0)])
+                _warm = True
+    return time.perf_counter() - t0
+
+
+def preload():
+    """Start warm_up() on a daemon thread; returns the thread."""
+    thread = threading.Thread(target=warm_up, name="models-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def face_locations(*args, **kwargs):
+    return get().face_locations(*args, **kwargs)
+
+
+def face_encodings(*args, **kwargs):
+    return get().face_encodings(*args, **kwargs)
+
+
+def face_landmarks(*args, **kwargs):
+    return get().face_landmarks(*args, **kwargs)
+
+
+def load_image_file(file, mode="RGB"):
+    """face_recognition.load_image_file() without importing dlib (same decoder)."""
+    from PIL import Image
+
+    with Image.open(file) as image:
+        return np.array(image.convert(mode))
@@ -0,0 +1,175 @@
+"""Face sample quality: keep sharp, frontal, distinct samples per student.
+
+Usage:
+    quality.py prune [dataset] [--dry-run] [--encodings python/encodings.bin]
+                     [--min-distance 0.1]
+
+register.py runs every detected face through a SampleSelector, so a
+registration keeps a varied set of samples rather than 20 near-identical
+consecutive frames. `prune` applies the same rules to images already in
+the dataset and moves the rejects to pruned/<id>/. The next encode_db run
+drops them from the gallery.
+"""
+import argparse
+import shutil
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import detection
+import encoding_cache
+import models
+from encode_db import DATASET, ROOT, load_manifest, manifest_path_for, read_sidecar, sidecar_path
+
+PRUNED = ROOT / "pruned"
+# Where app.py and main.cpp keep the gallery: next to the scripts
+ENCODINGS_PATH = Path(__file__).resolve().parent / "encodings.bin"
+
+# Sharpness is measured on the face resized to this many pixels square,
+# so the threshold does not depend on how close the student sat
+SHARPNESS_SIZE = 112
+
+
+def sharpness(gray):
+    """Variance of the Laplacian: low for blurred (motion or focus) crops."""
+    face = cv2.resize(gray, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(face, cv2.CV_64F).var())
+
+
+def yaw(landmarks):
+    """Horizontal offset of the nose tip from the eyes' midpoint, in eye distances.
+
+    About 0 for a frontal face, growing as the head turns; uses the 5-point
+    landmarks of face_recognition.face_landmarks(..., model="small").
+    """
+    left = np.mean(landmarks["left_eye"], axis=0)
+    right = np.mean(landmarks["right_eye"], axis=0)
+    nose = np.mean(landmarks["nose_tip"], axis=0)
+    eyes = np.linalg.norm(right - left)
+    if eyes == 0:
+        return float("inf")
+    return abs(float(nose[0] - (left[0] + right[0]) / 2)) / eyes
+
+
+class SampleSelector:
+    """Accept a face sample only if it is usable and not a near-duplicate.
+
+    check() is stateless and may run on several threads; keep() holds the
+    encodings accepted so far and must be called from one thread.
+    """
+
+    def __init__(self, min_size=80, min_sharpness=60.0, max_yaw=0.3, min_distance=0.1):
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+        self.min_distance = min_distance
+        self.kept = []
+        self.rejected = {}
+
+    def check(self, rgb, box):
+        """(reason or None, encoding, sharpness) for the face at `box` in `rgb`."""
+        top, right, bottom, left = box
+        if min(bottom - top, right - left) < self.min_size:
+            return "too small", None, 0.0
+        gray = cv2.cvtColor(rgb[max(0, top):bottom, max(0, left):right], cv2.COLOR_RGB2GRAY)
+        sharp = sharpness(gray)
+        if sharp < self.min_sharpness:
+            return "blurry", None, sharp
+        marks = models.face_landmarks(rgb, [box], model="small")
+        if not marks or yaw(marks[0]) > self.max_yaw:
+            return "off-angle", None, sharp
+        encodings = encoding_cache.encode(rgb, [box], num_jitters=1)
+        if not encodings:
+            return "no encoding", None, sharp
+        return None, encodings[0], sharp
+
+    def keep(self, reason, encoding):
+        """Record the outcome of check(); True if the sample should be kept."""
+        if reason is None and self.kept:
+            nearest = float(np.min(np.linalg.norm(np.array(self.kept) - encoding, axis=1)))
+            if nearest < self.min_distance:
+                reason = "duplicate"
+        if reason is not None:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+            return False
+        self.kept.append(np.asarray(encoding, dtype=np.float64))
+        return True
+
+    def summary(self):
+        rejected = ", ".join(f"{n} {reason}" for reason, n in sorted(self.rejected.items()))
+        return f"{len(self.kept)} kept, rejected: {rejected or 'none'}"
+
+
+def prune(dataset=DATASET, dry_run=False, encodings_path=ENCODINGS_PATH, **limits):
+    """Move low-quality and near-duplicate images of every student to pruned/."""
+    dataset = Path(dataset).resolve()
+    entries = load_manifest(manifest_path_for(Path(encodings_path).resolve()))
+    checker = SampleSelector(**limits)
+    moved = kept = 0
+
+    for student_dir in sorted(p for p in dataset.iterdir() if p.is_dir()):
+        assessed = []
+        for img_path in sorted(student_dir.glob("*.jpg")):
+            rgb = models.load_image_file(str(img_path))
+            box = read_sidecar(img_path)
+            if box is None:
+                boxes = detection.DATASET.detect(rgb)
+                box = boxes[0] if boxes else None
+            if box is None:
+                assessed.append((img_path, ("no face", None, 0.0)))
+                continue
+            reason, encoding, sharp = checker.check(rgb, box)
+            # Reuse the gallery's encoding so prune agrees with recognition
+            entry = entries.get(f"{student_dir.name}/{img_path.name}")
+            if reason is None and entry is not None and entry.get("encoding") is not None:
+                encoding = entry["encoding"]
+            assessed.append((img_path, (reason, encoding, sharp)))
+
+        # Sharpest first, so of two near-duplicates the better one stays
+        selector = SampleSelector(**limits)
+        assessed.sort(key=lambda item: -item[1][2])
+        for img_path, (reason, encoding, _) in assessed:
+            if selector.keep(reason, encoding):
+                kept += 1
+                continue
+            moved += 1
+            if dry_run:
+                continue
+            target = PRUNED / student_dir.name
+            target.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(img_path), str(target / img_path.name))
+            if sidecar_path(img_path).exists():
+                shutil.move(str(sidecar_path(img_path)), str(target / sidecar_path(img_path).name))
+        print(f"{student_dir.name}: {selector.summary()}")
+
+    action = "Would move" if dry_run else "Moved"
+    print(f"\n[OK] {action} {moved} image(s) to {PRUNED}, {kept} kept")
+    if moved and not dry_run:
+        print("[INFO] Run encode_db.py to drop them from the gallery")
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("prune", help="move low-quality and near-duplicate samples to pruned/")
+    p.add_argument("dataset", nargs="?", default=str(DATASET))
+    p.add_argument("--dry-run", action="store_true", help="only report what would be moved")
+    p.add_argument("--encodings", default=str(ENCODINGS_PATH),
+                   help="gallery whose manifest encodings are reused (default: %(default)s)")
+    p.add_argument("--min-distance", type=float, default=0.1,
+                   help="samples closer than this to a kept one are duplicates")
+    p.add_argument("--min-sharpness", type=float, default=60.0)
+    p.add_argument("--max-yaw", type=float, default=0.3)
+    p.add_argument("--min-size", type=int, default=80, help="smallest face side in pixels")
+    args = parser.parse_args()
+
+    prune(args.dataset, args.dry_run, args.encodings, min_distance=args.min_distance,
+          min_sharpness=args.min_sharpness, max_yaw=args.max_yaw, min_size=args.min_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""Recognition spread over worker processes.
+
+face_recognition holds the GIL through detection and encoding, so one
+server process recognises one face at a time however many cores there
+are. RecognitionPool starts N worker processes, each with its own dlib
+models, and hands every uploaded frame to the least busy one.
+
+Each gallery generation is copied once into a shared-memory block that
+all workers map, instead of each loading its own copy. In "replicate"
+mode every worker matches against the whole gallery. In "shard" mode
+each worker owns a slice of the rows: one worker detects and encodes a
+frame, every worker matches the encodings against its slice, and the
+closest match wins.
+
+Workers are started with "spawn": forking a server that already runs
+threads can copy a lock some other thread was holding (the metrics
+registry, the encoding cache, the models import) into a child that will
+never release it. A worker that dies fails the requests it was holding
+and is replaced on the next request or status check.
+"""
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from gallery import DIM, Gallery
+
+MODES = ("replicate", "shard")
+
+# Longest a request waits for a worker before giving up
+TIMEOUT = 30.0
+
+
+class SharedGallery:
+    """One gallery generation copied into a shared-memory block."""
+
+    def __init__(self, gallery):
+        n = len(gallery)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, n * (DIM + 2) * 4))
+        encodings, index, norms = _views(self.shm, n)
+        encodings[:] = gallery.encodings
+        index[:] = gallery.index
+        norms[:] = gallery.norms
+        self.spec = {"name": self.shm.name, "count": n, "labels": gallery.labels,
+                     "generation": gallery.generation}
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _views(shm, n):
+    # encodings, label index and squared norms, back to back
+    encodings = np.ndarray((n, DIM), np.float32, shm.buf)
+    index = np.ndarray((n,), np.int32, shm.buf, offset=n * DIM * 4)
+    norms = np.ndarray((n,), np.float32, shm.buf, offset=n * (DIM + 1) * 4)
+    return encodings, index, norms
+
+
+def attach(spec, shard=0, shards=1):
+    """(shared memory, Gallery over this shard's rows) without copying them."""
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    n = spec["count"]
+    lo, hi = n * shard // shards, n * (shard + 1) // shards
+    encodings, index, norms = _views(shm, n)
+    gallery = Gallery(encodings[lo:hi], index[lo:hi], spec["labels"], norms[lo:hi],
+                      generation=spec["generation"])
+    return shm, gallery
+
+
+def _decode(blob):
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def _serve(tasks, results, worker, shards):
+    # Worker process: load the models once, then answer tasks until None
+    import encoding_cache
+    import models
+    import recognize
+    from detection import CAMERA
+    from face_index import ExactIndex
+
+    models.warm_up()
+
+    shm = matcher = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        kind, task_id = task[0], task[1]
+        if kind == "load":
+            # Drop the views before unmapping the previous generation
+            matcher, old, shm = None, shm, None
+            if old is not None:
+                try:
+                    old.close()
+                except BufferError:
+                    pass        # a view is still referenced; unmapped when collected
+            try:
+                shm, gallery = attach(task[2], worker % shards, shards)
+                matcher = ExactIndex(gallery)
+                del gallery
+            except FileNotFoundError:
+                pass            # already replaced; the next load follows
+            continue
+        try:
+            if matcher is None and kind in ("frame", "match"):
+                # No students encoded yet: nothing can match
+                payload = []
+            elif kind == "frame":
+                payload = recognize.match_frame(_decode(task[2]), matcher, task[3])
+            elif kind == "encode":
+                rgb = _decode(task[2])
+                boxes = CAMERA.detect(rgb)
+                payload = (boxes, np.array(encoding_cache.encode(rgb, boxes)) if boxes else None)
+            elif kind == "match":
+                rows, dists = matcher.search(task[2])
+                labels, index = matcher.gallery.labels, matcher.gallery.index
+                payload = [(labels[index[r]], float(d)) for r, d in zip(rows, dists)]
+            else:
+                raise ValueError(f"unknown task {kind!r}")
+            results.put((task_id, worker, None, payload))
+        except Exception as e:
+            results.put((task_id, worker, (type(e).__name__, str(e)), None))
+
+
+class RecognitionPool:
+    """Front end that dispatches frames to `workers` recognition processes.
+
+    `engine` (a RecognitionEngine) supplies gallery snapshots; every new
+    generation it loads is published to the workers before the next frame.
+    """
+
+    def __init__(self, engine, workers=2, mode="replicate"):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        self.engine = engine
+        self.workers = workers
+        self.mode = mode
+        self._ctx = multiprocessing.get_context("spawn")
+        self._tasks = []
+        self._procs = []
+        self._results = None
+        self._pending = [0] * workers
+        self._futures = {}
+        self._owner = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._published = None
+        self._blocks = []
+        self._restarts = 0
+        self._closed = False
+
+    def start(self):
+        if os.name == "posix":
+            # Workers must share this process's tracker, or each would
+            # report the blocks they attached to as leaked on exit
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        self._results = self._ctx.Queue()
+        for n in range(self.workers):
+            tasks, proc = self._spawn(n)
+            self._tasks.append(tasks)
+            self._procs.append(proc)
+        threading.Thread(target=self._collect, daemon=True).start()
+        # Unlink the shared blocks even if the server never calls close()
+        atexit.register(self.close)
+        print(f"[POOL] Started {self.workers} recognition worker(s) ({self.mode})")
+        return self
+
+    def _spawn(self, n):
+        tasks = self._ctx.Queue()
+        shards = self.workers if self.mode == "shard" else 1
+        proc = self._ctx.Process(target=_serve, args=(tasks, self._results, n, shards), daemon=True)
+        proc.start()
+        return tasks, proc
+
+    def _reap(self):
+        """Replace dead workers; the futures they held, to fail. Call with _lock held."""
+        failed = []
+        if self._closed:
+            return failed
+        for n, proc in enumerate(self._procs):
+            if proc.is_alive():
+                continue
+            error = RuntimeError(f"Recognition worker {n} died (exit code {proc.exitcode})")
+            for task_id in [t for t, w in self._owner.items() if w == n]:
+                del self._owner[task_id]
+                future = self._futures.pop(task_id, None)
+                if future is not None:
+                    failed.append((future, error))
+            self._pending[n] = 0
+            # Its queue may still hold tasks nobody will read
+            self._tasks[n].cancel_join_thread()
+            self._tasks[n], self._procs[n] = self._spawn(n)
+            if self._blocks:
+                self._tasks[n].put(("load", None, self._blocks[-1].spec))
+            self._restarts += 1
+            print(f"[POOL] {error}; restarted it")
+        return failed
+
+    def _fail(self, failed):
+        for future, error in failed:
+            future.set_exception(error)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        for tasks in self._tasks:
+            tasks.put(None)
+        for proc in self._procs:
+            proc.join(timeout=5)
+        self._tasks, self._procs = [], []
+        with self._lock:
+            for block in self._blocks:
+                block.close()
+            self._blocks = []
+
+    def _collect(self):
+        while True:
+            try:
+                task_id, worker, error, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                # Nothing finished: make sure nobody is waiting on a dead worker
+                with self._lock:
+                    failed = self._reap()
+                self._fail(failed)
+                continue
+            with self._lock:
+                # Results of a task already failed by _reap are dropped
+                if self._owner.pop(task_id, None) is not None:
+                    self._pending[worker] -= 1
+                future = self._futures.pop(task_id, None)
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(payload)
+            elif error[0] == "ValueError":
+                future.set_exception(ValueError(error[1]))
+            else:
+                future.set_exception(RuntimeError(f"{error[0]}: {error[1]}"))
+
+    def _submit(self, kind, *args, worker=None):
+        future = Future()
+        with self._lock:
+            failed = self._reap()
+            if worker is None:
+                worker = min(range(self.workers), key=self._pending.__getitem__)
+            task_id = next(self._ids)
+            self._futures[task_id] = future
+            self._owner[task_id] = worker
+            self._pending[worker] += 1
+            tasks = self._tasks[worker]
+        self._fail(failed)
+        tasks.put((kind, task_id) + args)
+        return future
+
+    def publish(self):
+        """Share the engine's current gallery with the workers if it changed."""
+        self.engine.refresh()
+        matcher = self.engine.matcher
+        gallery = matcher.gallery if matcher is not None else None
+        with self._lock:
+            if gallery is None or gallery is self._published:
+                return
+            block = SharedGallery(gallery)
+            # Queues are FIFO, so every later task sees the new generation
+            for tasks in self._tasks:
+                tasks.put(("load", None, block.spec))
+            self._published = gallery
+            self._blocks.append(block)
+            # Keep the previous block for workers that have not switched yet
+            while len(self._blocks) > 2:
+                self._blocks.pop(0).close()
+
+    def match_blobs(self, blobs, threshold=None):
+        """[(box, (id or None, distance))] for each JPEG/PNG blob, like RecognitionEngine.match_image."""
+        threshold = self.engine.threshold if threshold is None else threshold
+        self.publish()
+        if self.mode == "replicate":
+            futures = [self._submit("frame", blob, threshold) for blob in blobs]
+            return [f.result(TIMEOUT) for f in futures]
+
+        encoded = [self._submit("encode", blob) for blob in blobs]
+        results = []
+        for future in encoded:
+            boxes, encodings = future.result(TIMEOUT)
+            if not boxes:
+                results.append([])
+                continue
+            shards = [self._submit("match", encodings, worker=w) for w in range(self.workers)]
+            best = [(None, float("inf"))] * len(boxes)
+            for shard in shards:
+                for i, (sid, dist) in enumerate(shard.result(TIMEOUT)):
+                    if dist < best[i][1]:
+                        best[i] = (sid, dist)
+            results.append([(box, (sid if dist < threshold else None, dist))
+                            for box, (sid, dist) in zip(boxes, best)])
+        return results
+
+    def status(self):
+        with self._lock:
+            failed = self._reap()
+            status = {"workers": self.workers, "mode": self.mode, "pending": list(self._pending),
+                      "alive": sum(p.is_alive() for p in self._procs), "restarts": self._restarts,
+                      "generation": self._published.generation if self._published else None}
+        self._fail(failed)
+        return status
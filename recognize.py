@@ -1,141 +1,260 @@
-import face_recognition
 import cv2
-import pickle
+import argparse
 import sys
 import json
-from datetime import datetime
-import csv
-from pathlib import Path
+import time
 
-# ROOT PATH
-ROOT = Path(__file__).resolve().parent.parent
-STUDENTS_CSV = ROOT / "students.csv"
-ATTENDANCE_CSV = ROOT / "attendance.csv"
-RESULT_JSON = ROOT / "result.json"
+import encoding_cache
+from attendance_writer import open_writer
+import metrics
+import models
+from capture import FramePipeline, StageStats
+from detection import CAMERA
+from face_index import index_path_for, load_index
+from gallery import Gallery
+from storage import open_storage
+from tracking import FaceTracker
 
-def recognize_face(encodings_path, threshold=0.35):
 
-    # Load encodings
-    try:
-        with open(encodings_path, "rb") as f:
-            data = pickle.load(f)
-        known_encodings = data["encodings"]
-        known_ids = data["ids"]
-        print(f"Loaded {len(known_encodings)} face encodings")
-    except Exception as e:
-        print(f"[ERROR] Could not load encodings: {e}")
-        return
+def load_encodings(encodings_path):
+    return Gallery.load(encodings_path)
 
-    # Open camera
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("[ERROR] Camera not detected!")
-        return
 
-    cap.set(3, 640)
-    cap.set(4, 480)
+def load_matcher(encodings_path, two_stage=False, nprobe=None):
+    # Gallery plus the search index encode_db.py built next to it
+    gallery = load_encodings(encodings_path)
+    matcher = load_index(index_path_for(encodings_path), gallery)
+    if two_stage and matcher.kind == "exact":
+        matcher.two_stage = True
+    if nprobe and matcher.kind == "ivf":
+        matcher.nprobe = nprobe
+    return matcher
 
-    print("\nCAMERA OPENED - Look at camera (press Q to exit)\n")
 
-    recognized_id = None
-    best_dist = 999
+def match_frame(rgb, matcher, threshold, policy=None):
+    """Detect, encode and match every face in an RGB image in one batch.
 
-    # Recognition loop
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            continue
+    Returns [(box, (id or None, distance))] with boxes (top, right, bottom,
+    left) in the coordinates of `rgb`. Detection runs on a copy shrunk by
+    `policy` (CAMERA by default), encoding on the full-resolution image.
+    """
+    with metrics.span("detect"):
+        boxes = (policy or CAMERA).detect(rgb)
+    metrics.count("faces_detected", len(boxes))
+    if len(boxes) == 0:
+        return []
+    with metrics.span("encode"):
+        encs = encoding_cache.encode(rgb, boxes)
+    with metrics.span("match"):
+        matches = matcher.match(encs, threshold)
+    metrics.count("faces_recognized", sum(1 for sid, _ in matches if sid is not None))
+    return list(zip(boxes, matches))
 
-        # Draw green guide box
-        h, w, _ = frame.shape
-        cv2.rectangle(frame, (w//4, h//4), (w - w//4, h - h//4), (0,255,0), 2)
-        cv2.putText(frame, "Align face in box", (w//4 + 10, h//4 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
 
-        # Reduce size for faster recognition
-        small = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-        rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+def capture_match(matcher, threshold=0.35, detect_every=10, source=0, headless=False,
+                  timeout=None):
+    # Detect every N frames (or on motion), track faces in between;
+    # raises TimeoutError if nobody is recognised within `timeout` seconds
+    stats = StageStats()
+    tracker = FaceTracker(matcher, threshold, detect_every=detect_every, stats=stats)
 
-        # Detect faces
-        boxes = face_recognition.face_locations(rgb, model="hog")
+    def process(frame):
+        # Runs on the consumer thread; hand back a snapshot of the tracks
+        return [(tracker.full_res_box(t), t.match, t.recognized) for t in tracker.step(frame)]
 
-        if len(boxes) > 0:
-            # Encode detected faces
-            encs = face_recognition.face_encodings(rgb, boxes)
+    # Open camera (capture runs on its own thread, keeping only the latest frame)
+    try:
+        pipe = FramePipeline(source, process, workers=1, stats=stats)
+    except IOError:
+        print("[ERROR] Camera not detected!")
+        return None, None
 
-            for enc in encs:
-                # Compare with known faces
-                distances = face_recognition.face_distance(known_encodings, enc)
+    print("\nCAMERA OPENED - Look at camera (press Q to exit)\n")
 
-                idx = distances.argmin()
-                dist = distances[idx]
+    recognized_id = None
+    best_dist = 999
+    deadline = time.monotonic() + timeout if timeout else None
+    timed_out = False
+
+    # Recognition loop
+    with pipe:
+        for _, frame, tracks in pipe:
+            # Draw green guide box
+            h, w, _ = frame.shape
+            cv2.rectangle(frame, (w//4, h//4), (w - w//4, h - h//4), (0,255,0), 2)
+            cv2.putText(frame, "Align face in box", (w//4 + 10, h//4 - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
+
+            for (top, right, bottom, left), match, recognized in tracks:
+                color = (0,255,0) if recognized else (0,165,255)
+                cv2.rectangle(frame, (left, top), (right, bottom), color, 1)
 
                 # If match found
-                if dist < threshold:
-                    recognized_id = known_ids[idx]
-                    best_dist = dist
+                if recognized:
+                    recognized_id, best_dist = match
 
                     cv2.putText(frame, f"ID: {recognized_id}", (30, 30),
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,0), 2)
-                    cv2.putText(frame, f"Match: {(1-dist)*100:.1f}%", (30, 60),
+                    cv2.putText(frame, f"Match: {(1-best_dist)*100:.1f}%", (30, 60),
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,0), 2)
                     break
 
-        cv2.imshow("Recognition", frame)
+            if not headless:
+                cv2.imshow("Recognition", frame)
+
+            # Break if recognized
+            if recognized_id is not None:
+                if not headless:
+                    cv2.waitKey(2000)  # Show result for 2 seconds
+                break
+
+            if not headless and cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+
+            if deadline and time.monotonic() >= deadline:
+                timed_out = True
+                break
+
+    if not headless:
+        cv2.destroyAllWindows()
+
+    print(f"[INFO] {tracker.frame_no} frames, {pipe.slot.dropped} dropped, "
+          f"{tracker.detections} detections, {tracker.encodings} encodings")
+    stats.report()
+
+    if timed_out:
+        raise TimeoutError(f"No face recognized within {timeout:g}s")
+
+    if recognized_id is None:
+        return None, None
+    return recognized_id, best_dist
+
+
+def lookup_name(student_id):
+    return open_storage().student_name(student_id)
+
+
+def mark_attendance(recognized_id, best_dist):
+    return mark_attendance_batch([{"id": recognized_id, "distance": best_dist}])[0]
 
-        # Break if recognized
-        if recognized_id is not None:
-            cv2.waitKey(2000)  # Show result for 2 seconds
-            break
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+def mark_attendance_batch(entries):
+    """Queue one attendance row per {"id", "distance"[, "time"]} with the shared writer.
 
-    cap.release()
-    cv2.destroyAllWindows()
+    Returns a row per entry; "duplicate" rows were already marked within
+    the dedup window and are not written again.
+    """
+    return open_writer().submit(entries)
+
+
+def recognize_session(encodings_path, threshold=0.35, duration=60, min_hits=3, window=3.0,
+                      source=0, headless=False):
+    from session import AttendanceSession, run_session
+
+    # Load encodings
+    try:
+        matcher = load_matcher(encodings_path)
+        print(f"Loaded {len(matcher.gallery)} face encodings ({matcher.kind} index)")
+    except Exception as e:
+        print(f"[ERROR] Could not load encodings: {e}")
+        return
+
+    # Load the dlib models while the camera opens
+    models.preload()
+
+    print(f"\nSESSION STARTED - recognising everyone for {duration}s (press Q to finish)\n")
+    stats = StageStats()
+    session = AttendanceSession(window=window, min_hits=min_hits)
+    try:
+        present = run_session(matcher, session, threshold, duration=duration,
+                              source=source, headless=headless, stats=stats)
+    except IOError:
+        print("[ERROR] Camera not detected!")
+        return
+
+    rows = mark_attendance_batch(present) if present else []
+    open_writer().flush()
+    marked = [r for r in rows if not r["duplicate"]]
+    print(f"\n[SUCCESS] Attendance marked for {len(marked)} student(s) "
+          f"({session.frames} frames, {len(rows) - len(marked)} already marked)")
+    for r in rows:
+        note = "  (already marked)" if r["duplicate"] else ""
+        print(f"  {r['id']:<10} {r['name']:<20} {r['time']}  {r['distance']:.4f}{note}")
+    stats.report()
+
+
+def recognize_face(encodings_path, threshold=0.35, two_stage=False, nprobe=None, detect_every=10,
+                   source=0, headless=False):
+
+    # Load encodings
+    try:
+        matcher = load_matcher(encodings_path, two_stage, nprobe)
+        print(f"Loaded {len(matcher.gallery)} face encodings ({matcher.kind} index)")
+    except Exception as e:
+        print(f"[ERROR] Could not load encodings: {e}")
+        return
+
+    # Load the dlib models while the camera opens
+    models.preload()
+
+    recognized_id, best_dist = capture_match(matcher, threshold, detect_every, source, headless)
 
     # If no face recognized
     if recognized_id is None:
         print("[ERROR] No face recognized")
         return
 
-    # Lookup student name
-    student_name = "Unknown"
-    if STUDENTS_CSV.exists():
-        with open(STUDENTS_CSV, "r", encoding="utf-8") as f:
-            for row in csv.reader(f):
-                if row and row[0] == recognized_id:
-                    student_name = row[1]
-                    break
+    result = mark_attendance(recognized_id, best_dist)
+    if not open_writer().flush():
+        print("[ERROR] Attendance could not be saved")
+        return
 
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # Save result.json (for C++ to read)
-    with open(RESULT_JSON, "w") as f:
-        json.dump({
-            "id": recognized_id,
-            "name": student_name,
-            "time": timestamp,
-            "distance": float(best_dist)
-        }, f, indent=4)
-
-    # Save attendance in CSV
-    with open(ATTENDANCE_CSV, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([recognized_id, student_name, timestamp, f"{best_dist:.4f}"])
-
-    print("\n[SUCCESS] Attendance marked!")
-    print(f"ID: {recognized_id}")
-    print(f"Name: {student_name}")
-    print(f"Time: {timestamp}")
+    if result["duplicate"]:
+        print("\n[INFO] Attendance already marked!")
+    else:
+        print("\n[SUCCESS] Attendance marked!")
+    print(f"ID: {result['id']}")
+    print(f"Name: {result['name']}")
+    print(f"Time: {result['time']}")
     print(f"Distance: {best_dist:.4f}\n")
 
+    # One machine-readable line for main.cpp (replaces result.json)
+    print("RESULT " + json.dumps(result), flush=True)
+
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("[ERROR] Usage: recognize.py <encodings_path> [threshold]")
-        sys.exit(1)
-    
-    enc_path = sys.argv[1]
-    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.35
-    recognize_face(enc_path, threshold)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Recognize a face and mark attendance")
+    parser.add_argument("encodings_path")
+    parser.add_argument("threshold", nargs="?", type=float, default=0.35)
+    parser.add_argument("--two-stage", action="store_true",
+                        help="match against student centroids first, then that student's samples")
+    parser.add_argument("--nprobe", type=int, default=None,
+                        help="ivf index: partitions scanned per query")
+    parser.add_argument("--detect-every", type=positive_int, default=10,
+                        help="run face detection every N frames (and on motion), track in between")
+    parser.add_argument("--source", default="0",
+                        help="camera index, video file, or image folder/glob (default: camera 0)")
+    parser.add_argument("--headless", action="store_true", help="do not open a preview window")
+    parser.add_argument("--session", type=float, metavar="SECONDS", default=None,
+                        help="recognise every face for SECONDS and mark all of them in one batch")
+    parser.add_argument("--min-hits", type=int, default=3,
+                        help="session: frames a student must be matched in before being marked")
+    parser.add_argument("--dedup-window", type=float, default=300,
+                        help="seconds within which a student is not marked again (default: 300)")
+    args = parser.parse_args()
+    open_writer(dedup_window=args.dedup_window)
+
+    if args.session:
+        recognize_session(args.encodings_path, args.threshold, args.session, args.min_hits,
+                          source=args.source, headless=args.headless)
+        sys.exit(0)
+
+    recognize_face(args.encodings_path, args.threshold, args.two_stage, args.nprobe,
+                   args.detect_every, args.source, args.headless)
@@ -1,13 +1,19 @@
-import cv2, sys, csv
+import cv2, sys, time, argparse
 from pathlib import Path
-import face_recognition
+
+import models
+from capture import FramePipeline, StageStats
+from detection import CAMERA, to_full
+from quality import SampleSelector
+from encode_db import write_sidecar
+from storage import open_storage
 
 # Absolute paths
 ROOT = Path(__file__).resolve().parent.parent
 DATASET = ROOT / "dataset"
-STUDENTS_CSV = ROOT / "students.csv"
 
-def register(student_id, student_name, samples=20):
+def register(student_id, student_name, samples=20, source=0, headless=False, workers=2,
+             timeout=90, selector=None):
 
     # Ensure dataset folder exists
     DATASET.mkdir(exist_ok=True)
@@ -18,66 +24,84 @@ def register(student_id, student_name, samples=20):
 
     print(f"[INFO] Saving images to: {student_dir}")
 
-    # Open camera
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("[ERROR] Camera not detected!")
-        return 1
-
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-    count = 0
-
-    # Capture loop
-    while count < samples:
-        ret, frame = cap.read()
-        if not ret:
-            continue
+    stats = StageStats()
+    selector = selector or SampleSelector()
+    deadline = time.time() + timeout if timeout else None
 
+    def detect(frame):
         # Convert to RGB and shrink for fast detection
-        rgb = frame[:, :, ::-1]
-        small = cv2.resize(rgb, (0, 0), fx=0.5, fy=0.5)
-
-        # Detect faces
-        boxes = face_recognition.face_locations(small, model="hog")
+        with stats.time("resize"):
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            small, scale = CAMERA.shrink(rgb)
 
-        for (top, right, bottom, left) in boxes:
+        # Detect faces, boxes come back in full-frame coordinates
+        with stats.time("detect"):
+            boxes = to_full(CAMERA.locate(small), scale, frame.shape)
 
-            # Scale back the box (because we used 0.5 size)
-            top *= 2; right *= 2; bottom *= 2; left *= 2
+        # Size/blur/angle checks and the encoding, still on this worker
+        with stats.time("quality"):
+            return [(box, selector.check(rgb, box)) for box in boxes]
 
-            # Extract face
-            face_img = frame[top:bottom, left:right]
+    # Load the dlib models while the camera opens
+    models.preload()
 
-            # Skip if face area is invalid
-            if face_img.size == 0:
-                continue
-
-            # Save face image
-            img_path = student_dir / f"{student_id}_{count+1}.jpg"
-            cv2.imwrite(str(img_path), face_img)
-
-            count += 1
-            print(f"[OK] Captured {count}/{samples}")
-
-        cv2.imshow("Register - Press Q to stop", frame)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
+    # Open camera (capture thread + detection workers on the latest frame)
+    try:
+        pipe = FramePipeline(source, detect, workers=workers, stats=stats)
+    except IOError:
+        print("[ERROR] Camera not detected!")
+        return 1
 
-    cap.release()
-    cv2.destroyAllWindows()
+    count = 0
 
-    # Check if student already exists
-    existing_ids = set()
-    if STUDENTS_CSV.exists():
-        with open(STUDENTS_CSV, "r", encoding="utf-8") as f:
-            existing_ids = {row[0] for row in csv.reader(f) if row}
+    # Capture loop
+    with pipe:
+        for _, frame, checked in pipe:
+            for (top, right, bottom, left), (reason, encoding, _) in checked:
+
+                # Extract face
+                face_img = frame[top:bottom, left:right]
+
+                # Skip invalid, poor or near-duplicate samples
+                if face_img.size == 0 or not selector.keep(reason, encoding):
+                    continue
+
+                # Save face image; the whole crop is the face box, so
+                # encode_db.py can skip detection on it (known-crop mode)
+                img_path = student_dir / f"{student_id}_{count+1}.jpg"
+                cv2.imwrite(str(img_path), face_img)
+                h, w = face_img.shape[:2]
+                write_sidecar(img_path, (0, w, h, 0))
+
+                count += 1
+                print(f"[OK] Captured {count}/{samples}")
+                if count >= samples:
+                    break
+
+            if count >= samples:
+                break
+            if deadline and time.time() >= deadline:
+                print(f"[WARN] Timed out with {count}/{samples} samples")
+                break
+
+            if not headless:
+                cv2.imshow("Register - Press Q to stop", frame)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+
+    if not headless:
+        cv2.destroyAllWindows()
+    print(f"[INFO] Samples: {selector.summary()}")
+    stats.report()
+
+    if count == 0:
+        print(f"[ERROR] No usable face samples captured - {student_id} was not registered")
+        if not any(student_dir.iterdir()):
+            student_dir.rmdir()
+        return 1
 
-    # Append student to students.csv (only if new)
-    if student_id not in existing_ids:
-        with open(STUDENTS_CSV, "a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([student_id, student_name])
+    # Add student to the database (only if new)
+    if open_storage().add_student(student_id, student_name):
         print(f"[INFO] Student {student_id} added to database")
     else:
         print(f"[WARN] Student {student_id} already exists - updated images only")
@@ -88,7 +112,19 @@ def register(student_id, student_name, samples=20):
 
 
 if __name__ == "__main__":
-    sid = sys.argv[1]
-    name = sys.argv[2]
-    samples = int(sys.argv[3]) if len(sys.argv) > 3 else 20
-    register(sid, name, samples)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Capture face samples for a student")
+    parser.add_argument("student_id")
+    parser.add_argument("name")
+    parser.add_argument("samples", nargs="?", type=int, default=20)
+    parser.add_argument("--source", default="0",
+                        help="camera index, video file, or image folder/glob (default: camera 0)")
+    parser.add_argument("--headless", action="store_true", help="do not open a preview window")
+    parser.add_argument("--workers", type=int, default=2, help="detection threads")
+    parser.add_argument("--timeout", type=float, default=90,
+                        help="stop after this many seconds even if short of samples")
+    parser.add_argument("--min-distance", type=float, default=0.1,
+                        help="skip samples closer than this to one already kept")
+    args = parser.parse_args()
+    sys.exit(register(args.student_id, args.name, args.samples, args.source,
+                      args.headless, args.workers, args.timeout,
+                      SampleSelector(min_distance=args.min_distance)))
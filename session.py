@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+import encoding_cache
+from capture import FramePipeline, stage
+from detection import SESSION, to_full
+
+
+class AttendanceSession:
+    """Accumulates matches for a whole class over a time window.
+
+    A student is confirmed once they were matched in `min_hits` frames
+    within `window` seconds (debounces one-off false matches); after that
+    further sightings only refine the best distance, so each student is
+    marked at most once per session.
+    """
+
+    def __init__(self, window=3.0, min_hits=3):
+        self.window = window
+        self.min_hits = min_hits
+        self.started = time.time()
+        self.stopped = None
+        self.frames = 0
+        self.error = None
+        self.marked = None
+        self._hits = {}
+        self._confirmed = {}
+        self._lock = threading.Lock()
+
+    def observe(self, matches, now=None):
+        """Feed the (id or None, distance) matches of one frame."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self.frames += 1
+            for sid, dist in matches:
+                if sid is None:
+                    continue
+                if sid in self._confirmed:
+                    entry = self._confirmed[sid]
+                    entry["distance"] = min(entry["distance"], dist)
+                    entry["hits"] += 1
+                    continue
+                hits = self._hits.setdefault(sid, deque())
+                hits.append((now, dist))
+                while hits and now - hits[0][0] > self.window:
+                    hits.popleft()
+                if len(hits) >= self.min_hits:
+                    self._confirmed[sid] = {
+                        "id": sid,
+                        "time": now,
+                        "distance": min(d for _, d in hits),
+                        "hits": len(hits),
+                    }
+                    del self._hits[sid]
+
+    def confirmed(self):
+        """Confirmed students in the order they were first confirmed."""
+        with self._lock:
+            return sorted((dict(e) for e in self._confirmed.values()), key=lambda e: e["time"])
+
+    def stop(self):
+        self.stopped = time.time()
+        return self.confirmed()
+
+
+def run_session(matcher, session, threshold=0.35, stop_event=None, duration=None,
+                source=0, headless=True, workers=2, policy=SESSION, stats=None):
+    """Recognise every face in each frame until stopped; fills `session`."""
+    stop_event = stop_event or threading.Event()
+    deadline = time.time() + duration if duration else None
+
+    def process(frame):
+        with stage(stats, "resize"):
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            small, scale = policy.shrink(rgb)
+        with stage(stats, "detect"):
+            boxes = to_full(policy.locate(small), scale, rgb.shape)
+        if not boxes:
+            return [], []
+        with stage(stats, "encode"):
+            encs = encoding_cache.encode(rgb, boxes)
+        with stage(stats, "match"):
+            matches = matcher.match(encs, threshold)
+        session.observe(matches)
+        return boxes, matches
+
+    with FramePipeline(source, process, workers=workers, stats=stats) as pipe:
+        for _, frame, (boxes, matches) in pipe:
+            if not headless:
+                for (top, right, bottom, left), (sid, _) in zip(boxes, matches):
+                    color = (0,255,0) if sid is not None else (0,165,255)
+                    cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+                    if sid is not None:
+                        cv2.putText(frame, sid, (left, top - 8),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+                cv2.putText(frame, f"Present: {len(session.confirmed())}", (30, 30),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0,255,0), 2)
+                cv2.imshow("Attendance session - press Q to finish", frame)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+            if stop_event.is_set() or (deadline and time.time() >= deadline):
+                break
+
+    if not headless:
+        cv2.destroyAllWindows()
+    return session.stop()
@@ -0,0 +1,118 @@
+"""Dashboard statistics kept in memory between /api/stats polls."""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from gallery import Gallery
+
+
+class StatsCache:
+    """Attendance/student aggregates plus gallery figures, updated incrementally.
+
+    In-process writes arrive through Storage.subscribe() and are applied as
+    deltas. Writes by other processes (recognize.py from the C++ menu, a
+    second server) are noticed through PRAGMA data_version and the storage
+    revision counter and trigger one full reload; the gallery figures are
+    reloaded whenever the encodings file's mtime/size changes.
+    """
+
+    def __init__(self, storage, encodings_path, days=14):
+        self.storage = storage
+        self.encodings_path = encodings_path
+        self.days = days
+        self._conn = sqlite3.connect(storage.path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._revision = None       # None = reload from the database on next read
+        self._data_version = None
+        self._today = None
+        self._students = 0
+        self._per_day = {}
+        self._present = set()
+        self._gallery_stamp = None
+        self._gallery = {}
+        storage.subscribe(self._on_write)
+
+    def _on_write(self, kind, payload, revision):
+        with self._lock:
+            # Only apply a delta on top of exactly the state it follows
+            if self._revision is None or revision != self._revision + 1 or kind == "import":
+                self._revision = None
+                return
+            self._revision = revision
+            if kind == "attendance":
+                for r in payload:
+                    day = r["time"][:10]
+                    self._per_day[day] = self._per_day.get(day, 0) + 1
+                    if day == self._today:
+                        self._present.add(r["id"])
+            elif kind == "student" and payload["new"]:
+                self._students += 1
+
+    def _reload(self, today):
+        # One read transaction so the counts and the revision agree
+        c = self._conn
+        c.execute("BEGIN")
+        try:
+            self._revision = self.storage.revision(c)
+            self._students = c.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+            self._per_day = dict(c.execute(
+                "SELECT substr(time, 1, 10), COUNT(*) FROM attendance GROUP BY 1"))
+            self._present = {r[0] for r in c.execute(
+                "SELECT DISTINCT student_id FROM attendance WHERE time >= ?", (today,))}
+        finally:
+            c.execute("COMMIT")
+        self._today = today
+
+    def _check_database(self):
+        today = datetime.now().strftime("%Y-%m-%d")
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._revision is not None and today == self._today and data_version == self._data_version:
+            return
+        # data_version also moves for this process's own commits; the
+        # revision tells whether they were all applied as deltas already
+        if (self._revision is None or today != self._today
+                or self.storage.revision(self._conn) != self._revision):
+            self._reload(today)
+        self._data_version = data_version
+
+    def _check_gallery(self):
+        try:
+            st = os.stat(self.encodings_path)
+        except OSError:
+            self._gallery_stamp, self._gallery = None, {}
+            return
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self._gallery_stamp:
+            return
+        try:
+            gallery = Gallery.load(self.encodings_path)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Could not read {self.encodings_path} for stats: {e}")
+            return
+        counts = np.bincount(gallery.index, minlength=len(gallery.labels))
+        self._gallery = {
+            "gallery_size": len(gallery),
+            "encodings_per_student": {label: int(n) for label, n in zip(gallery.labels, counts)},
+            "last_encode_time": datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self._gallery_stamp = stamp
+
+    def snapshot(self):
+        with self._lock:
+            self._check_database()
+            self._check_gallery()
+            today = datetime.strptime(self._today, "%Y-%m-%d")
+            days = [(today - timedelta(days=n)).strftime("%Y-%m-%d")
+                    for n in range(self.days - 1, -1, -1)]
+            return {
+                "students": self._students,
+                "attendance_records": sum(self._per_day.values()),
+                "present_today": len(self._present),
+                "per_day": [{"date": d, "count": self._per_day.get(d, 0)} for d in days],
+                "gallery_size": self._gallery.get("gallery_size", 0),
+                "encodings_per_student": self._gallery.get("encodings_per_student", {}),
+                "last_encode_time": self._gallery.get("last_encode_time"),
+            }
@@ -0,0 +1,330 @@
+"""SQLite storage for students and attendance (replaces the CSV files).
+
+    storage.py import [--force]     one-shot import of students.csv/attendance.csv
+    storage.py export [file] [--format csv|ndjson] [--from DATE] [--to DATE]
+                                    attendance export (stdout by default)
+    storage.py students             list students
+    storage.py attendance           list attendance records
+"""
+import argparse
+import base64
+import binascii
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+import metrics
+
+# ROOT PATH
+ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = ROOT / "fras.db"
+STUDENTS_CSV = ROOT / "students.csv"
+ATTENDANCE_CSV = ROOT / "attendance.csv"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    id      TEXT PRIMARY KEY,
+    name    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attendance (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_id  TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    time        TEXT NOT NULL,
+    distance    REAL
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_student_time ON attendance (student_id, time);
+CREATE INDEX IF NOT EXISTS idx_attendance_time ON attendance (time);
+CREATE TABLE IF NOT EXISTS meta (
+    key     TEXT PRIMARY KEY,
+    value   TEXT
+);
+"""
+
+
+class Storage:
+    """Students and attendance in one SQLite database (WAL mode).
+
+    Each thread gets its own connection; WAL lets readers (dashboard) run
+    while a writer (recognition) commits. Every write also bumps a revision
+    counter in the same transaction, so caches can tell their own updates
+    from writes made by other processes.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = os.path.abspath(path)
+        self._local = threading.local()
+        self._listeners = []
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def subscribe(self, callback):
+        """Call `callback(kind, payload, revision)` after each committed write."""
+        self._listeners.append(callback)
+
+    def _bump(self, conn):
+        # Must run inside the write transaction
+        conn.execute("INSERT INTO meta (key, value) VALUES ('revision', 1) "
+                     "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+        return self.revision(conn)
+
+    def _notify(self, kind, payload, revision):
+        for callback in self._listeners:
+            callback(kind, payload, revision)
+
+    def revision(self, conn=None):
+        row = (conn or self.connect()).execute(
+            "SELECT value FROM meta WHERE key = 'revision'").fetchone()
+        return int(row[0]) if row else 0
+
+    # Students
+
+    def add_student(self, student_id, name):
+        """Insert a student unless the id exists; returns True if it was new."""
+        with metrics.span("db_write", table="students"), self.connect() as conn:
+            cur = conn.execute("INSERT OR IGNORE INTO students (id, name) VALUES (?, ?)",
+                               (student_id, name))
+            if cur.rowcount != 1:
+                return False
+            revision = self._bump(conn)
+        self._notify("student", {"id": student_id, "name": name, "new": True}, revision)
+        return True
+
+    def upsert_student(self, student_id, name):
+        """Insert or rename a student; returns True if the id was new."""
+        with metrics.span("db_write", table="students"), self.connect() as conn:
+            existed = conn.execute("SELECT 1 FROM students WHERE id = ?", (student_id,)).fetchone()
+            conn.execute(
+                "INSERT INTO students (id, name) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name",
+                (student_id, name))
+            revision = self._bump(conn)
+        self._notify("student", {"id": student_id, "name": name, "new": existed is None}, revision)
+        return existed is None
+
+    def get_student(self, student_id):
+        row = self.connect().execute(
+            "SELECT name FROM students WHERE id = ?", (student_id,)).fetchone()
+        return row[0] if row else None
+
+    def student_name(self, student_id, default="Unknown"):
+        name = self.get_student(student_id)
+        return default if name is None else name
+
+    def list_students(self):
+        rows = self.connect().execute("SELECT id, name FROM students ORDER BY rowid")
+        return [{"id": r[0], "name": r[1]} for r in rows]
+
+    def count_students(self):
+        return self.connect().execute("SELECT COUNT(*) FROM students").fetchone()[0]
+
+    # Attendance
+
+    def add_attendance(self, rows):
+        """Insert {"id", "name", "time", "distance"} rows in one transaction."""
+        with metrics.span("db_write", table="attendance"), self.connect() as conn:
+            conn.executemany(
+                "INSERT INTO attendance (student_id, name, time, distance) VALUES (?, ?, ?, ?)",
+                [(r["id"], r["name"], r["time"], r["distance"]) for r in rows])
+            revision = self._bump(conn)
+        metrics.count("attendance_rows", len(rows))
+        self._notify("attendance", rows, revision)
+
+    @staticmethod
+    def _filters(student_id=None, start=None, end=None, min_distance=None, max_distance=None):
+        # WHERE clauses served by idx_attendance_student_time / idx_attendance_time
+        clauses, params = [], []
+        if student_id:
+            clauses.append("student_id = ?")
+            params.append(student_id)
+        if start:
+            clauses.append("time >= ?")
+            params.append(start)
+        if end:
+            # A bare date includes the whole day
+            clauses.append("time <= ?")
+            params.append(end + " 23:59:59" if len(end) == 10 else end)
+        if min_distance is not None:
+            clauses.append("distance >= ?")
+            params.append(float(min_distance))
+        if max_distance is not None:
+            clauses.append("distance <= ?")
+            params.append(float(max_distance))
+        return clauses, params
+
+    @staticmethod
+    def encode_cursor(row):
+        return base64.urlsafe_b64encode(f"{row['time']}|{row['seq']}".encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """(time, seq) from an opaque cursor; ValueError if it is malformed."""
+        try:
+            time, seq = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+            return time, int(seq)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValueError(f"invalid cursor: {cursor!r}")
+
+    def query_attendance(self, cursor=None, limit=100, **filters):
+        """One page of attendance, newest first; returns (rows, next_cursor).
+
+        Keyset pagination on (time, seq): each page is an index range scan
+        that starts where the previous one stopped, however deep the page.
+        """
+        clauses, params = self._filters(**filters)
+        if cursor:
+            clauses.append("(time, seq) < (?, ?)")
+            params.extend(self.decode_cursor(cursor))
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        cur = self.connect().execute(
+            f"SELECT seq, student_id, name, time, distance FROM attendance {where} "
+            "ORDER BY time DESC, seq DESC LIMIT ?", params + [limit + 1])
+        rows = [{"seq": seq, "id": student_id, "name": name, "time": time, "distance": distance}
+                for seq, student_id, name, time, distance in cur]
+        next_cursor = self.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def iter_attendance(self, chunk=500, **filters):
+        """Matching attendance rows, oldest first, fetched `chunk` at a time."""
+        clauses, params = self._filters(**filters)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        cur = self.connect().execute(
+            f"SELECT student_id, name, time, distance FROM attendance {where} "
+            "ORDER BY time, seq", params)
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                return
+            for student_id, name, time, distance in rows:
+                yield {"id": student_id, "name": name, "time": time, "distance": distance}
+
+    def export_attendance(self, fmt="csv", chunk=500, **filters):
+        """Export as CSV (attendance.csv columns) or NDJSON, one text chunk per `chunk` rows."""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for i, r in enumerate(self.iter_attendance(chunk=chunk, **filters), 1):
+            if fmt == "ndjson":
+                buf.write(json.dumps(r) + "\n")
+            else:
+                distance = "" if r["distance"] is None else f"{r['distance']:.4f}"
+                writer.writerow([r["id"], r["name"], r["time"], distance])
+            if i % chunk == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    # CSV import
+
+    def import_csv(self, students_csv=STUDENTS_CSV, attendance_csv=ATTENDANCE_CSV, force=False):
+        """Copy the legacy CSV files in once; returns (students, attendance rows)."""
+        conn = self.connect()
+        if not force and conn.execute(
+                "SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+            return 0, 0
+
+        students = {}
+        if Path(students_csv).exists():
+            with open(students_csv, "r", encoding="utf-8") as f:
+                for row in csv.reader(f):
+                    # students.csv has duplicate rows; the last name wins
+                    if len(row) >= 2 and row[0].strip():
+                        students[row[0].strip()] = row[1].strip()
+
+        attendance = []
+        if Path(attendance_csv).exists():
+            with open(attendance_csv, "r", encoding="utf-8") as f:
+                for row in csv.reader(f):
+                    # Skip the id,name-only backup rows main.cpp used to append
+                    if len(row) >= 3 and row[0].strip():
+                        distance = float(row[3]) if len(row) > 3 and row[3] else None
+                        attendance.append({"id": row[0], "name": row[1],
+                                           "time": row[2], "distance": distance})
+
+        with conn:
+            conn.executemany(
+                "INSERT INTO students (id, name) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name",
+                list(students.items()))
+            # Rows already present (re-import with --force) are skipped
+            conn.executemany(
+                "INSERT INTO attendance (student_id, name, time, distance) "
+                "SELECT ?, ?, ?, ? WHERE NOT EXISTS "
+                "(SELECT 1 FROM attendance WHERE student_id = ? AND time = ?)",
+                [(r["id"], r["name"], r["time"], r["distance"], r["id"], r["time"])
+                 for r in attendance])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_imported', '1')")
+            revision = self._bump(conn)
+        self._notify("import", None, revision)
+        return len(students), len(attendance)
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def open_storage(path=DB_PATH, students_csv=STUDENTS_CSV, attendance_csv=ATTENDANCE_CSV):
+    """Shared Storage for this process; a fresh database imports the CSVs once."""
+    global _default
+    with _default_lock:
+        if _default is None or _default.path != os.path.abspath(path):
+            storage = Storage(path)
+            students, rows = storage.import_csv(students_csv, attendance_csv)
+            if students or rows:
+                print(f"[INFO] Imported {students} students and {rows} attendance rows from CSV")
+            _default = storage
+        return _default
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Students/attendance database (fras.db)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("import", help="import students.csv/attendance.csv")
+    p.add_argument("--force", action="store_true", help="import again even if done before")
+    p = sub.add_parser("export", help="export attendance (stdout by default)")
+    p.add_argument("output", nargs="?")
+    p.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    p.add_argument("--from", dest="start", help="YYYY-MM-DD[ HH:MM:SS]")
+    p.add_argument("--to", dest="end", help="YYYY-MM-DD[ HH:MM:SS] (a bare date is inclusive)")
+    p.add_argument("--student")
+    sub.add_parser("students", help="list students")
+    sub.add_parser("attendance", help="list attendance records")
+    args = parser.parse_args()
+
+    storage = Storage(DB_PATH)
+    if args.cmd == "import":
+        students, rows = storage.import_csv(force=args.force)
+        print(f"[OK] Imported {students} students and {rows} attendance rows into {DB_PATH}")
+    elif args.cmd == "export":
+        out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+        for text in storage.export_attendance(args.format, student_id=args.student,
+                                              start=args.start, end=args.end):
+            out.write(text)
+        if out is not sys.stdout:
+            out.close()
+    elif args.cmd == "students":
+        for s in storage.list_students():
+            print(f"{s['id']} | {s['name']}")
+    else:
+        for text in storage.export_attendance("csv"):
+            sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
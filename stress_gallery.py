@@ -0,0 +1,152 @@
+"""Stress test: readers load the gallery while writers publish new generations.
+
+Usage:
+    stress_gallery.py [--seconds 10] [--readers 8] [--writers 2] [--processes 2] [--copy]
+
+Writer threads and writer processes take gallery_lock() in turns and save
+generation g as a gallery whose every value is g, so a reader can tell a
+torn or mixed file from a whole one. Readers never take the lock: they
+stat the file, load a snapshot when it changed, verify it and keep
+matching against it while newer generations replace the file.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from gallery import DIM, Gallery, gallery_lock, read_generation
+
+
+def publish(path):
+    # One writer step: next generation under the cross-process lock
+    with gallery_lock(path):
+        generation = read_generation(path) + 1
+        rows = 50 + generation % 200
+        encodings = np.full((rows, DIM), generation, dtype=np.float32)
+        gallery = Gallery.from_lists(encodings, [f"g{generation}"] * rows,
+                                     [{"path": f"g{generation}/{i}.jpg", "sha1": ""} for i in range(rows)])
+        gallery.save(path, generation)
+    return generation
+
+
+def check(gallery):
+    """Problems with a loaded snapshot ([] if it is one whole generation)."""
+    g = gallery.generation
+    problems = []
+    if len(gallery) != 50 + g % 200:
+        problems.append(f"generation {g}: {len(gallery)} rows")
+    if gallery.labels != [f"g{g}"]:
+        problems.append(f"generation {g}: labels {gallery.labels[:3]}")
+    if not np.all(np.asarray(gallery.encodings) == g):
+        problems.append(f"generation {g}: mixed encodings")
+    if gallery.provenance is None or len(gallery.provenance) != len(gallery):
+        problems.append(f"generation {g}: provenance does not match rows")
+    return problems
+
+
+def writer_process(path, deadline):
+    while time.time() < deadline:
+        publish(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2, help="writer threads")
+    parser.add_argument("--processes", type=int, default=2, help="writer processes")
+    parser.add_argument("--copy", action="store_true",
+                        help="readers load private copies instead of mmap (the Windows default)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stress_gallery_")
+    path = os.path.join(workdir, "encodings.bin")
+    publish(path)
+    deadline = time.time() + args.seconds
+
+    lock = threading.Lock()
+    failures = []
+    loads = []
+    searches = [0]
+    written = [0]
+
+    def writer():
+        while time.time() < deadline:
+            publish(path)
+            with lock:
+                written[0] += 1
+
+    def reader():
+        snapshot, stamp, last, latencies, done = None, None, 0, [], 0
+        probe = np.zeros((1, DIM), dtype=np.float32)
+        while time.time() < deadline:
+            try:
+                st = os.stat(path)
+                if (st.st_mtime_ns, st.st_size) != stamp:
+                    t0 = time.perf_counter()
+                    gallery = Gallery.load(path, mmap=not args.copy)
+                    latencies.append(time.perf_counter() - t0)
+                    problems = check(gallery)
+                    if gallery.generation < last:
+                        problems.append(f"generation went back from {last} to {gallery.generation}")
+                    if problems:
+                        with lock:
+                            failures.extend(problems)
+                    snapshot, stamp, last = gallery, (st.st_mtime_ns, st.st_size), gallery.generation
+                # Keep using the snapshot while writers replace the file
+                [(sid, dist)] = snapshot.match(probe, threshold=1e9)
+                if sid != f"g{last}" or abs(dist - np.sqrt(DIM) * last) > 1e-3 * last:
+                    with lock:
+                        failures.append(f"generation {last}: search returned a foreign row")
+                done += 1
+            except Exception as e:
+                with lock:
+                    failures.append(f"{type(e).__name__}: {e}")
+        with lock:
+            loads.extend(latencies)
+            searches[0] += done
+
+    procs = [multiprocessing.Process(target=writer_process, args=(path, deadline))
+             for _ in range(args.processes)]
+    threads = ([threading.Thread(target=writer) for _ in range(args.writers)]
+               + [threading.Thread(target=reader) for _ in range(args.readers)])
+    for p in procs:
+        p.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for p in procs:
+        p.join()
+
+    generations = read_generation(path)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    loads.sort()
+    print("\n============================================================")
+    print("GALLERY CONCURRENCY STRESS TEST")
+    print("============================================================")
+    print(f"Duration:    {args.seconds:.0f}s, {args.readers} readers, "
+          f"{args.writers} writer threads, {args.processes} writer processes, "
+          f"{'copy' if args.copy else 'mmap'} loads")
+    print(f"Generations: {generations} published ({written[0]} by threads)")
+    print(f"Reloads:     {len(loads)}, searches on snapshots: {searches[0]}")
+    if loads:
+        print(f"Reload ms:   p50 {loads[len(loads) // 2] * 1000:.2f}, "
+              f"p99 {loads[min(len(loads) - 1, int(0.99 * len(loads)))] * 1000:.2f}, "
+              f"max {loads[-1] * 1000:.2f}")
+    print(f"Failures:    {len(failures)}")
+    for problem in failures[:10]:
+        print(f"  {problem}")
+    print("============================================================\n")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
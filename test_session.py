@@ -0,0 +1,56 @@
+"""A timed session writes its attendance without /api/session/stop.
+
+Run with:  python -m unittest test_session   (no camera or dlib needed)
+"""
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import session
+from attendance_writer import open_writer
+from engine import RecognitionEngine
+from storage import open_storage
+
+
+def fake_run_session(matcher, sess, threshold=0.35, stop_event=None, duration=None, **kwargs):
+    # Three sightings of one student, then wait out the duration like the camera loop
+    deadline = time.time() + duration
+    for _ in range(3):
+        sess.observe([("S001", 0.2)])
+    while time.time() < deadline and not stop_event.is_set():
+        time.sleep(0.01)
+    return sess.stop()
+
+
+class TimedSessionTest(unittest.TestCase):
+    def setUp(self):
+        tmp = Path(tempfile.mkdtemp())
+        self.storage = open_storage(tmp / "fras.db", tmp / "students.csv", tmp / "attendance.csv")
+        open_writer(self.storage, dedup_window=0)
+        self.engine = RecognitionEngine(tmp / "encodings.bin", dataset=tmp)
+        self.engine.matcher = mock.Mock(gallery=[object()])
+        self.engine.refresh = lambda: None
+
+    def rows(self):
+        return self.storage.query_attendance(student_id="S001")[0]
+
+    @mock.patch.object(session, "run_session", fake_run_session)
+    def test_expired_session_marks_and_can_restart(self):
+        self.engine.start_session(duration=0.1)
+        thread = self.engine._session[2]
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([r["id"] for r in self.rows()], ["S001"])
+        self.assertEqual(len(self.engine.session_status()["marked"]), 1)
+
+        # The finished session neither blocks a new one nor is written twice by stop
+        self.engine.start_session(duration=0.1)
+        sess, rows = self.engine.stop_session()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(len(self.rows()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
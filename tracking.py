@@ -0,0 +1,144 @@
+import cv2
+
+import encoding_cache
+from capture import stage
+from detection import CAMERA, to_full
+
+
+class Track:
+    """One face followed across frames; its encoding/match are computed once."""
+
+    def __init__(self, box, template):
+        self.box = box          # (top, right, bottom, left) in detection scale
+        self.template = template
+        self.match = None       # (student id or None, distance)
+        self.misses = 0
+
+    @property
+    def recognized(self):
+        return self.match is not None and self.match[0] is not None
+
+
+def iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda r: max(0, r[1] - r[3]) * max(0, r[2] - r[0])
+    union = area(a) + area(b) - inter
+    return inter / union if union else 0.0
+
+
+class FaceTracker:
+    """Detect every `detect_every` frames (or on motion), track in between.
+
+    Between detections each face box is moved by template matching in a
+    small search window, which costs far less than HOG + a 128-d encoding.
+    Encodings are computed only for new tracks, and again on detection
+    frames for tracks that have not matched anyone yet.
+    """
+
+    def __init__(self, matcher, threshold=0.35, detect_every=10, motion_threshold=12.0,
+                 policy=CAMERA, iou_threshold=0.3, max_misses=2, stats=None):
+        if detect_every < 1:
+            raise ValueError(f"detect_every must be at least 1, got {detect_every}")
+        self.matcher = matcher
+        self.stats = stats
+        self.threshold = threshold
+        self.detect_every = detect_every
+        self.motion_threshold = motion_threshold
+        self.policy = policy
+        self.scale = None       # detection scale the policy picked for the frame size
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.tracks = []
+        self.frame_no = 0
+        self._last_gray = None
+        self.detections = 0
+        self.encodings = 0
+
+    def _motion(self, gray):
+        if self._last_gray is None or self._last_gray.shape != gray.shape:
+            return True
+        return float(cv2.absdiff(gray, self._last_gray).mean()) > self.motion_threshold
+
+    def _template(self, gray, box):
+        top, right, bottom, left = box
+        return gray[max(0, top):bottom, max(0, left):right].copy()
+
+    def _follow(self, gray, track):
+        # Search a window twice the box size around the last position
+        top, right, bottom, left = track.box
+        h, w = bottom - top, right - left
+        tmpl = track.template
+        if tmpl.size == 0:
+            return False
+        y0, x0 = max(0, top - h // 2), max(0, left - w // 2)
+        y1, x1 = min(gray.shape[0], bottom + h // 2), min(gray.shape[1], right + w // 2)
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < tmpl.shape[0] or window.shape[1] < tmpl.shape[1]:
+            return False
+        scores = cv2.matchTemplate(window, tmpl, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if score < 0.5:
+            return False
+        top, left = y0 + dy, x0 + dx
+        track.box = (top, left + w, top + h, left)
+        return True
+
+    def _detect(self, frame, rgb, gray):
+        self.detections += 1
+        with stage(self.stats, "detect"):
+            boxes = self.policy.locate(rgb)
+
+        # Associate detections with existing tracks by overlap
+        survivors, fresh = [], []
+        unclaimed = list(self.tracks)
+        for box in boxes:
+            best = max(unclaimed, key=lambda t: iou(t.box, box), default=None)
+            if best is not None and iou(best.box, box) >= self.iou_threshold:
+                unclaimed.remove(best)
+                best.box, best.template, best.misses = box, self._template(gray, box), 0
+                survivors.append(best)
+            else:
+                fresh.append(Track(box, self._template(gray, box)))
+        for track in unclaimed:
+            track.misses += 1
+            if track.misses <= self.max_misses:
+                survivors.append(track)
+
+        # Encode new tracks plus any still-unknown faces, in one batch and
+        # at full resolution
+        pending = fresh + [t for t in survivors if not t.recognized and t.misses == 0]
+        if pending:
+            with stage(self.stats, "encode"):
+                full = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                boxes = to_full([t.box for t in pending], self.scale, frame.shape)
+                encs = encoding_cache.encode(full, boxes)
+            self.encodings += len(encs)
+            with stage(self.stats, "match"):
+                matches = self.matcher.match(encs, self.threshold)
+            for track, match in zip(pending, matches):
+                track.match = match
+        self.tracks = survivors + fresh
+
+    def step(self, frame):
+        """Advance one BGR frame; returns the current tracks."""
+        with stage(self.stats, "resize"):
+            small, self.scale = self.policy.shrink(frame)
+            gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        if self.frame_no % self.detect_every == 0 or self._motion(gray):
+            with stage(self.stats, "resize"):
+                rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+            self._detect(frame, rgb, gray)
+            self._last_gray = gray
+        else:
+            with stage(self.stats, "track"):
+                self.tracks = [t for t in self.tracks if self._follow(gray, t)]
+
+        self.frame_no += 1
+        return self.tracks
+
+    def full_res_box(self, track):
+        # Map a track box back to the original frame size
+        return tuple(int(round(v / self.scale)) for v in track.box)